@@ -0,0 +1,81 @@
+import os
+import csv
+import datetime
+
+import providers
+
+COLUMNS = ["route", "passengers"] + providers.FLIGHT_DEFAULT
+
+
+def load_manifest(path: str, default_providers: list = None, default_passengers: int = 1):
+    path = os.path.expanduser(path)
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension in (".yaml", ".yml"):
+        try:
+            import yaml
+
+        except ImportError:
+            raise ValueError("YAML manifests require PyYAML (pip install pyyaml), or use a .csv manifest") from None
+
+        with open(path) as f:
+            data = yaml.safe_load(f) or []
+
+        rows = data.get("routes", []) if isinstance(data, dict) else data
+
+    elif extension == ".csv":
+        with open(path, newline="") as f:
+            rows = [{k.strip(): v.strip() for k, v in row.items() if k and v and v.strip()}
+                    for row in csv.DictReader(f)]
+
+    else:
+        raise ValueError("unsupported manifest %s (use .yaml, .yml or .csv)" % extension)
+
+    return [parse_job(row, default_providers, default_passengers, line) for line, row in enumerate(rows, 1)]
+
+
+def parse_job(row: dict, default_providers: list = None, default_passengers: int = 1, line: int = 0):
+    departure = row.get("departure", row.get("from"))
+    destination = row.get("destination", row.get("to"))
+    date = row.get("date")
+    if not all((departure, destination, date)):
+        raise ValueError("job %d: departure, destination and date required" % line)
+
+    departure = str(departure).upper()
+    destination = str(destination).upper()
+    if len(departure) != 3 or len(destination) != 3:
+        raise ValueError("job %d: departure and destination must be IATA code" % line)
+
+    # YAML already parses dates
+    date = str(date)
+    to_date = str(row.get("to_date", date))
+    datetime.date.fromisoformat(date)
+    datetime.date.fromisoformat(to_date)
+
+    provider = row.get("provider", row.get("providers"))
+    return {
+        "departure": departure,
+        "destination": destination,
+        "date": date,
+        "to_date": to_date,
+        "adults": int(row.get("passengers", default_passengers)),
+        "providers": providers.parse_providers(",".join(provider) if isinstance(provider, list) else provider)
+        if provider else list(default_providers or ["eDreams"])
+    }
+
+
+def plan(jobs: list):
+    # Overlapping jobs share their (route, date, passengers) searches
+    units = {}
+    for job in jobs:
+        date = datetime.date.fromisoformat(job["date"])
+        while date <= datetime.date.fromisoformat(job["to_date"]):
+            key = (job["departure"], job["destination"], date.isoformat(), job["adults"])
+            units.setdefault(key, {
+                "departure": job["departure"], "destination": job["destination"],
+                "date": date.isoformat(), "adults": job["adults"], "providers": set()
+            })["providers"].update(job["providers"])
+
+            date = date + datetime.timedelta(1)
+
+    return list(units.values())
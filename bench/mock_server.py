@@ -0,0 +1,119 @@
+import os
+import time
+import random
+import threading
+import http.server
+
+# Synthetic responses shaped like the real APIs: real airports, generated flights and prices
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def load_fixture(name: str):
+    with open(os.path.join(FIXTURES_DIR, name), "rb") as f:
+        return f.read()
+
+
+class MockHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # (method, path prefix, fixture), matched in order
+    ROUTES = (
+        ("GET", "/travel/service/frontendapi/getVisitInformation", None),
+        ("POST", "/frontend-api/service/graphql", "edreams_search.json"),
+        ("POST", "/travel/service/flow/flexibledates/prices", "edreams_flexible.json"),
+        ("GET", "/frontend-home/service/geo/autocomplete", "edreams_autocomplete.json"),
+        ("GET", "/api/booking/v4/", "ryanair_availability.json"),
+        ("GET", "/api/locate/v1/autocomplete/airports", "ryanair_autocomplete.json")
+    )
+
+    # Home pages visited for the session cookies (eDreams, Ryanair), matched exactly: any other path is a 404
+    HOME_PATHS = ("/", "/it/it")
+
+    def handle_request(self, method: str):
+        server = self.server
+
+        if self.headers.get("Content-Length"):
+            self.rfile.read(int(self.headers["Content-Length"]))
+
+        with server.lock:
+            server.requests += 1
+
+        if server.latency:
+            time.sleep(random.uniform(*server.latency))
+
+        if server.error_rate and random.random() < server.error_rate:
+            return self.reply(random.choice(server.error_status), b"error")
+
+        for route_method, prefix, fixture in self.ROUTES:
+            if method == route_method and self.path.startswith(prefix):
+                return self.reply(200, server.fixtures[fixture] if fixture else b"<html></html>",
+                                  "application/json" if fixture else "text/html")
+
+        if method == "GET" and self.path.split("?")[0] in self.HOME_PATHS:
+            return self.reply(200, b"<html></html>", "text/html")
+
+        self.reply(404, b"No HTTP resource was found")
+
+    def reply(self, status: int, body: bytes, content_type: str = "text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Set-Cookie", "viI=mock-visit; Path=/")
+        self.send_header("Set-Cookie", "OF1JSESSIONID=mock-session; Path=/")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def log_message(self, *args):
+        pass
+
+
+class MockServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: tuple = None, error_rate: float = 0.0, error_status: tuple = (429, 503),
+                 host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), MockHandler)
+
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+        self.fixtures = {fixture: load_fixture(fixture) for _, _, fixture in MockHandler.ROUTES if fixture}
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://%s:%d" % self.server_address
+
+    def start(self):
+        threading.Thread(name="MockServer", target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve the recorded provider responses")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, nargs=2, metavar=("MIN", "MAX"), help="Latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with an error")
+    args = parser.parse_args()
+
+    mock = MockServer(args.latency, args.error_rate, port=args.port)
+    print("Serving on", mock.url)
+    try:
+        mock.serve_forever()
+
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,176 @@
+import os
+import sys
+import json
+import time
+import datetime
+import argparse
+import tempfile
+import itertools
+import contextlib
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import providers
+import providers.base
+import providers.locations
+import writers
+from flyscanner import FlyScanner
+from providers.throttle import Throttle
+from mock_server import MockServer, load_fixture
+
+
+class FixtureResponse:
+    def __init__(self, content: bytes, status_code: int = 200):
+        self.content = content
+        self.status_code = status_code
+
+    @property
+    def text(self):
+        return self.content.decode()
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def percentile(samples: list, p: float):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+
+
+def report(name: str, samples: list, total: float, peak: int = None):
+    result = {
+        "name": name,
+        "count": len(samples),
+        "total_s": round(total, 4),
+        "per_s": round(len(samples) / total, 2) if total else None,
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "peak_kb": round(peak / 1024, 1) if peak is not None else None
+    }
+
+    print("%-32s %6d  %8.2f/s  p50 %9.3f ms  p99 %9.3f ms%s" % (
+        name, result["count"], result["per_s"] or 0, result["p50_ms"], result["p99_ms"],
+        "  peak %.1f KB" % result["peak_kb"] if peak is not None else ""))
+
+    return result
+
+
+def timed(func, iterations: int):
+    samples = []
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        call_start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - call_start)
+
+    total = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return samples, total, peak
+
+
+# Benchmarks
+def bench_parse(provider_name: str, fixture: str, iterations: int):
+    provider = providers.PROVIDERS[provider_name]()
+    response = FixtureResponse(load_fixture(fixture))
+    provider.request = lambda *args, **kwargs: response
+    provider.throttle = Throttle(provider.MAX_CONCURRENCY)
+
+    location = {"iata": "AAA", "geoNodeId": 1}
+    samples, total, peak = timed(lambda: provider.search(1, "2030-01-01", location, location), iterations)
+    return report("parse %s" % provider_name, samples, total, peak)
+
+
+def bench_search_loop(server: MockServer, provider_name: str, days: int, workers: int):
+    fly = FlyScanner(provider_name, workers=workers)
+
+    samples = []
+    for provider in fly.providers:
+        def search(*args, _search=provider.search):
+            call_start = time.perf_counter()
+            try:
+                return _search(*args)
+
+            finally:
+                samples.append(time.perf_counter() - call_start)
+
+        provider.search = search
+
+    departure = fly.prepare_location("FCO")
+    destination = fly.prepare_location("STN")
+
+    from_date = datetime.date.today() + datetime.timedelta(30)
+    requests_before = server.requests
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        fly.start_search(departure, destination, from_date.isoformat(),
+                         (from_date + datetime.timedelta(days - 1)).isoformat())
+
+    total = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result = report("start_search %s x%d" % (provider_name, workers), samples, total, peak)
+    result["http_requests"] = server.requests - requests_before
+    return result
+
+
+def bench_save(extension: str, rows: int, tmp_dir: str):
+    provider = providers.PROVIDERS["eDreams"]()
+    provider.request = lambda *args, **kwargs: FixtureResponse(load_fixture("edreams_search.json"))
+    location = {"iata": "AAA", "geoNodeId": 1}
+    flights = itertools.cycle(provider.search(1, "2030-01-01", location, location)["result"])
+
+    writer = writers.open_writer(os.path.join(tmp_dir, "bench" + extension), "bench")
+    samples, total, peak = timed(lambda: writer.write(next(flights)), rows)
+
+    close_start = time.perf_counter()
+    writer.close()
+    return report("save %s" % extension, samples, total + time.perf_counter() - close_start, peak)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark FlyScanner offline against synthetic provider responses")
+    parser.add_argument("--iterations", type=int, default=200, help="Parse iterations (default 200)")
+    parser.add_argument("--days", type=int, default=30, help="Dates searched by start_search (default 30)")
+    parser.add_argument("--workers", type=int, default=8, help="start_search workers (default 8)")
+    parser.add_argument("--rows", type=int, default=20000, help="Rows written by the save benchmark")
+    parser.add_argument("--latency", type=float, nargs=2, default=(0.05, 0.15), metavar=("MIN", "MAX"),
+                        help="Mock server latency in seconds (default 0.05 0.15)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of mock requests failing")
+    parser.add_argument("--no-throttle", action='store_true', help="Disable the provider rate limit")
+    parser.add_argument("--json", type=str, metavar="PATH", help="Write the results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Never touch the user cache and sessions
+        providers.base.CACHE_DIR = tmp
+        providers.locations.CACHE_DIR = tmp
+
+        server = MockServer(tuple(args.latency), args.error_rate).start()
+        for provider_cls in providers.PROVIDERS.values():
+            provider_cls.BASE_URL = server.url
+            if args.no_throttle:
+                provider_cls.RATE = None
+
+        results = [
+            bench_parse("eDreams", "edreams_search.json", args.iterations),
+            bench_parse("Ryanair", "ryanair_availability.json", args.iterations),
+            bench_search_loop(server, "eDreams", args.days, 1),
+            bench_search_loop(server, "eDreams", args.days, args.workers),
+            bench_search_loop(server, "all", args.days, args.workers)
+        ]
+
+        for extension in (".csv", ".jsonl", ".xlsx"):
+            results.append(bench_save(extension, args.rows, tmp))
+
+        server.stop()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,97 @@
+import os
+import json
+import time
+import sqlite3
+import datetime
+import threading
+
+import providers
+from providers.models import Flight
+from providers.jsonlib import loads
+
+# (days before departure, seconds): the closer the flight, the faster prices change
+TTL_DEFAULT = (
+    (3, 15 * 60),
+    (14, 60 * 60),
+    (60, 3 * 60 * 60),
+    (None, 12 * 60 * 60)
+)
+
+
+class SearchCache:
+    def __init__(self, path: str = os.path.join(providers.CACHE_DIR, "results.sqlite"), ttl=TTL_DEFAULT,
+                 max_age: float = None, refresh: bool = False):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self.max_age = max_age
+        self.refresh = refresh
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS searches ("
+                        "provider TEXT, num_adults INTEGER, date TEXT, departure TEXT, destination TEXT, "
+                        "fetched_at REAL, result TEXT, "
+                        "PRIMARY KEY (provider, num_adults, date, departure, destination))")
+        self.purge()
+
+    def ttl_for(self, date: str):
+        if self.max_age is not None:
+            return self.max_age
+
+        days = (datetime.date.fromisoformat(date) - datetime.date.today()).days
+        for limit, ttl in self.ttl:
+            if limit is None or days <= limit:
+                return ttl
+
+        return self.ttl[-1][1]
+
+    @staticmethod
+    def key(provider, num_adults: int, date: str, departure: dict, destination: dict):
+        return provider.NAME, num_adults, date, departure["iata"], destination["iata"]
+
+    def get(self, provider, num_adults: int, date: str, departure: dict, destination: dict, max_age: float = None):
+        if self.refresh:
+            return None
+
+        with self._lock:
+            row = self.db.execute("SELECT fetched_at, result FROM searches WHERE provider = ? AND num_adults = ? "
+                                  "AND date = ? AND departure = ? AND destination = ?",
+                                  self.key(provider, num_adults, date, departure, destination)).fetchone()
+
+        # The caller can ask for fresher results than the TTL (the watcher polls more often)
+        ttl = self.ttl_for(date) if max_age is None else min(max_age, self.ttl_for(date))
+        if not row or time.time() - row[0] > ttl:
+            return None
+
+        search_resp = loads(row[1])
+        return {"date": search_resp["date"], "result": [Flight.from_dict(x) for x in search_resp["result"]],
+                "fetched_at": row[0]}
+
+    def put(self, provider, num_adults: int, date: str, departure: dict, destination: dict, search_resp: dict):
+        with self._lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            self.key(provider, num_adults, date, departure, destination) +
+                            (time.time(), json.dumps({"date": search_resp["date"],
+                                                      "result": [x.to_dict() for x in search_resp["result"]]})))
+
+    def search(self, provider, num_adults: int, date: str, departure: dict, destination: dict,
+               max_age: float = None):
+        search_resp = self.get(provider, num_adults, date, departure, destination, max_age)
+        if search_resp is None:
+            # A blocked or failed search raises before anything is stored
+            search_resp = provider.search(num_adults, date, departure, destination)
+            self.put(provider, num_adults, date, departure, destination, search_resp)
+
+        return search_resp
+
+    def purge(self):
+        oldest = max(self.max_age or 0, *(ttl for _, ttl in self.ttl))
+        with self._lock, self.db:
+            self.db.execute("DELETE FROM searches WHERE fetched_at < ?", (time.time() - oldest,))
+
+    def close(self):
+        with self._lock:
+            self.db.close()
@@ -0,0 +1,55 @@
+import os
+import json
+import time
+import threading
+
+
+class Checkpoint:
+    # One JSON line per finished (route, date, passengers, provider) search, appended as soon as it is done,
+    # so an interrupted scan can be resumed without searching them again
+    def __init__(self, path: str, resume: bool = False):
+        self.path = os.path.expanduser(path)
+        self.done = set()
+        self._lock = threading.Lock()
+
+        if resume:
+            self.load()
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.file = open(self.path, "a" if resume else "w")
+
+    @staticmethod
+    def key(route: str, date: str, adults: int, provider_name: str):
+        return route, date, adults, provider_name
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.done.add(self.key(entry["route"], entry["date"], entry["adults"], entry["provider"]))
+
+                    except (ValueError, KeyError):
+                        # The last line of a killed run can be incomplete
+                        continue
+
+        except FileNotFoundError:
+            pass
+
+    def is_done(self, route: str, date: str, adults: int, provider_name: str):
+        return self.key(route, date, adults, provider_name) in self.done
+
+    def record(self, route: str, date: str, adults: int, provider_name: str):
+        with self._lock:
+            self.done.add(self.key(route, date, adults, provider_name))
+            if self.file.closed:
+                return
+
+            self.file.write(json.dumps({"route": route, "date": date, "adults": adults, "provider": provider_name,
+                                        "at": time.time()}) + "\n")
+            self.file.flush()
+
+    def close(self):
+        with self._lock:
+            self.file.close()
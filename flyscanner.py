@@ -1,121 +1,406 @@
 import os
 import datetime
+import itertools
+import collections
+import concurrent.futures
 from typing import Union
 
+import batch
+import table
+import checkpoint
+import render
+import pairing
 import providers
+import writers
+from providers.metrics import span
 
 
 class FlyScanner:
-    def __init__(self, provider, print_all=False, print_detail=True):
-        self.provider = providers.PROVIDERS[provider]()
+    REQUEUE_LIMIT = 2
+
+    def __init__(self, provider, print_all=False, print_detail=True, workers=1, cache=None, history=None,
+                 output_format="pretty", nearby=False, ranking=None, checkpoint=None):
+        provider_names = providers.parse_providers(provider) if isinstance(provider, str) else list(provider)
+
+        # Sessions are bootstrapped by the first search of every provider
+        self.providers = [providers.PROVIDERS[name]() for name in provider_names]
+
         self.searching = False
 
         self.print_all = print_all
         self.print_detail = print_detail
+        self.renderer = render.open_renderer(output_format, show_all=print_all, detail=print_detail,
+                                             show_provider=len(self.providers) > 1)
+
+        self.workers = max(1, workers)
+        self.cache = cache
+        self.history = history
+        self.nearby = nearby
+        self.ranking = ranking
+        self.checkpoint = checkpoint
+        self.checkpoint_pending = []
 
         self.save = False
-        self.workbook = None
-        self.sheet = None
+        self.writer = None
 
     def prepare_location(self, iata):
-        return self.provider.prepare_location({"iata": iata})
+        # Every provider has its own location format: keep one per provider, skip the unresolved ones
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.providers)) as executor:
+            locations = executor.map(lambda provider: self.prepare_provider_location(provider, iata), self.providers)
+
+        return {provider.NAME: location for provider, location in zip(self.providers, locations) if location}
+
+    def prepare_provider_location(self, provider, iata):
+        with span("prepare_location", provider.NAME):
+            location = provider.prepare_location({"iata": iata})
+            if location and self.nearby:
+                location = dict(location, nearby=provider.nearby_locations(location))
+
+            return location
+
+    def fetch(self, provider, adults: int, date: str, departure_iata: dict, destination_iata: dict,
+              max_age: float = None):
+        with span("search", provider.NAME):
+            if self.cache:
+                return self.cache.search(provider, adults, date, departure_iata, destination_iata, max_age)
+
+            return provider.search(adults, date, departure_iata, destination_iata)
+
+    @staticmethod
+    def provider_queries(provider, departure: dict, destination: dict):
+        # Every (nearby departure, nearby destination), once per distinct provider query
+        queries = {}
+        for nearby_departure in departure.get("nearby") or [departure]:
+            for nearby_destination in destination.get("nearby") or [destination]:
+                key = provider.query_key(nearby_departure), provider.query_key(nearby_destination)
+                if key[0] != key[1]:
+                    queries.setdefault(key, (nearby_departure, nearby_destination))
+
+        return list(queries.values())
+
+    def submit_search(self, executor, adults: int, date: str, departure_iata: dict, destination_iata: dict,
+                      search_providers: list = None, max_age: float = None):
+        return [(provider, executor.submit(self.fetch, provider, adults, date, departure, destination, max_age))
+                for provider in search_providers or self.providers
+                if provider.NAME in departure_iata and provider.NAME in destination_iata
+                for departure, destination in self.provider_queries(provider, departure_iata[provider.NAME],
+                                                                    destination_iata[provider.NAME])]
+
+    def merge_results(self, date: str, futures: list, previous: dict = None):
+        result = list(previous["result"]) if previous else []
+        fetched = list(previous["fetched"]) if previous else []
+        failed = []
+        for provider, future in futures:
+            try:
+                provider_resp = future.result()
+                result.extend(provider_resp["result"])
+
+                # Cached results were observed when they were fetched, only the new ones go to the history
+                if "fetched_at" not in provider_resp:
+                    fetched.extend(provider_resp["result"])
+
+            except Exception as e:
+                if not isinstance(e, providers.SearchCancelled):
+                    self.renderer.message("[!] %s failed for %s: %s (rate %s req/s)" % (
+                        provider.NAME, date, e, "%.2f" % provider.throttle.rate if provider.throttle.rate else "-"))
+
+                if provider not in failed:
+                    failed.append(provider)
+
+        return {"date": date, "result": sorted(result, key=lambda i: i.price), "fetched": fetched}, failed
 
     def search(self, adults: int, date: str, departure_iata: dict, destination_iata: dict):
-        search_resp = self.provider.search(adults, date, departure_iata, destination_iata)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.providers)) as executor:
+            futures = self.submit_search(executor, adults, date, departure_iata, destination_iata)
+            self.print_results(self.merge_results(date, futures)[0])
 
-        for solution in search_resp["result"]:
-            if self.save:
-                self.save_to_file(solution)
+        self.renderer.flush()
 
-            print("  \u2022 ✈️  FOUND:", solution["price"], solution["price_currency"], "-",
-                  solution["carrier"], "-", "🕓", solution["duration"], "✈️ ")
+    def print_results(self, search_resp: dict, **extra):
+        if self.ranking:
+            search_resp = dict(search_resp, result=self.ranking.apply(search_resp["result"]))
 
-            if not self.print_detail:
-                break
+        if self.save:
+            for solution in search_resp["result"] if self.print_all else search_resp["result"][:1]:
+                self.save_to_file(solution, **extra)
 
-            print("  Departure:", solution["departure_date"])
-            print("  From:", solution["departure_location"])
-            print("  Arrival:", solution["arrival_date"])
-            print("  To:", solution["arrival_location"])
+        self.renderer.render(search_resp, **extra)
 
-            if solution["stops"] > 1:
-                print("  Stops:", solution["stops"] - 1, "-", "No Fly Duration:", solution["stops_duration"])
+    @staticmethod
+    def iter_dates(from_date: str, to_date: str = None):
+        searching_date = datetime.date.fromisoformat(from_date)
+        stop_date = datetime.date.fromisoformat(to_date) if to_date else None
 
-                for stop in range(solution["stops"]):
-                    print("   \u2022 ✈️  STOP %d  ✈️ " % (stop + 1))
-                    print("   Departure:", solution["stops_detail"][stop]["departure_date"])
-                    print("   From:", solution["stops_detail"][stop]["departure_location"])
-                    print("   Arrival:", solution["stops_detail"][stop]["arrival_date"])
-                    print("   To:", solution["stops_detail"][stop]["arrival_location"])
-                    print("   Duration:", solution["stops_detail"][stop]["duration"])
+        while not stop_date or searching_date <= stop_date:
+            yield searching_date.isoformat()
+            searching_date = searching_date + datetime.timedelta(1)
 
-            if len(solution["discounts"]) > 0:
-                print("  Available Discounts:")
-                for discount in solution["discounts"]:
-                    print("   Discount:", discount["price"], discount["price_currency"], discount["reason"])
+    def calendar_dates(self, departure_iata: dict, destination_iata: dict, from_date: str, to_date: str = None,
+                       cheapest: int = None, max_price: float = None):
+        calendar = {}
+        for provider in self.providers:
+            if provider.NAME not in departure_iata or provider.NAME not in destination_iata:
+                continue
 
-            print()
+            # A provider without a calendar now only loses the shortcut, the dates are searched one by one
+            try:
+                prices = provider.price_calendar(departure_iata[provider.NAME], destination_iata[provider.NAME],
+                                                 from_date)
 
-            if not self.print_all:
-                break
+            except providers.SearchCancelled:
+                continue
 
-    def start_search(self, departure_iata, destination_iata, from_date, to_date=None, adults=1,
-                     save: Union[bool, str] = False):
+            except (providers.ProviderError, ValueError) as e:
+                self.renderer.message("[!] %s price calendar failed: %s" % (provider.NAME, e))
+                continue
 
-        searching_date = datetime.date.fromisoformat(from_date)
-        stop_date = datetime.date.fromisoformat(to_date) if to_date else None
+            for date, price in (prices or {}).items():
+                if date >= from_date and (not to_date or date <= to_date):
+                    calendar[date] = min(price, calendar.get(date, price))
+
+        if not calendar:
+            return None
+
+        dates = sorted(calendar, key=lambda d: (calendar[d], d))
+        if max_price is not None:
+            dates = [d for d in dates if calendar[d] <= max_price]
+
+        if cheapest:
+            dates = dates[:cheapest]
+
+        return sorted(dates)
+
+    def start_search(self, departure_iata, destination_iata, from_date, to_date=None, adults=1,
+                     save: Union[bool, str] = False, cheapest: int = None, max_price: float = None,
+                     round_trip: bool = False, return_from: dict = None, return_to: dict = None,
+                     min_stay: int = 1, max_stay: int = 7, min_gap: float = 2, top: int = 10):
 
         if save:
             self.save = os.path.expanduser(save)
-            if os.path.exists(self.save):
-                self.workbook = openpyxl.load_workbook(self.save)
-                self.sheet = self.workbook.create_sheet()
+            self.writer = writers.open_writer(self.save, "%s %s (%s)" % (
+                next(iter(departure_iata.values()))["iata"], next(iter(destination_iata.values()))["iata"],
+                datetime.datetime.now().strftime("%y-%m-%d %H.%M.%S")
+            ), columns=pairing.COLUMNS if round_trip else None)
+
+        # A round trip needs a closed window of outbound dates
+        if round_trip and not to_date:
+            to_date = from_date
+
+        self.searching = True
+        self.renderer.message("Provider: %s" % ", ".join(provider.NAME for provider in self.providers))
+
+        dates = self.iter_dates(from_date, to_date)
+        if cheapest or max_price is not None:
+            calendar_dates = self.calendar_dates(departure_iata, destination_iata, from_date, to_date,
+                                                 cheapest, max_price)
+            if calendar_dates is None:
+                self.renderer.message("[!] No price calendar available, searching every date")
 
             else:
-                self.workbook = openpyxl.Workbook()
-                self.sheet = self.workbook.active
+                self.renderer.message("Price calendar: %d dates selected" % len(calendar_dates))
+                dates = iter(calendar_dates)
+
+        if round_trip:
+            self.search_round_trip(departure_iata, destination_iata, list(dates), adults, return_from, return_to,
+                                   min_stay, max_stay, min_gap, top)
+
+        else:
+            self.scan(self.search_units(departure_iata, destination_iata, dates, adults))
+
+    def search_round_trip(self, departure_iata: dict, destination_iata: dict, dates: list, adults: int = 1,
+                          return_from: dict = None, return_to: dict = None, min_stay: int = 1, max_stay: int = 7,
+                          min_gap: float = 2, top: int = 10):
+        # Every day of both directions is searched once (one-way), then the cheapest valid pairs are selected;
+        # an open-jaw trip returns from `return_from` and/or to `return_to`
+        if not dates:
+            return []
+
+        return_from = return_from or destination_iata
+        return_to = return_to or departure_iata
+
+        return_dates = self.iter_dates(
+            (datetime.date.fromisoformat(min(dates)) + datetime.timedelta(min_stay)).isoformat(),
+            (datetime.date.fromisoformat(max(dates)) + datetime.timedelta(max_stay + 1)).isoformat())
+
+        flights = {"outbound": [], "inbound": []}
+        units = itertools.chain(
+            (dict(unit, leg="outbound", label="%s %s" % (unit["route"], unit["date"]))
+             for unit in self.search_units(departure_iata, destination_iata, dates, adults)),
+            (dict(unit, leg="inbound", label="%s %s" % (unit["route"], unit["date"]))
+             for unit in self.search_units(return_from, return_to, return_dates, adults))
+        )
+        self.scan(units, collect=lambda unit, search_resp: flights[unit["leg"]].extend(search_resp["result"]))
+
+        if self.ranking:
+            flights = {leg: self.ranking.apply(leg_flights) for leg, leg_flights in flights.items()}
+
+        pairs = pairing.top_pairs(flights["outbound"], flights["inbound"], min_stay, max_stay,
+                                  datetime.timedelta(hours=min_gap), top)
+
+        self.renderer.message("Round trip: %d outbound and %d return flights, %d best pairs" % (
+            len(flights["outbound"]), len(flights["inbound"]), len(pairs)))
+        self.renderer.render_pairs(pairs)
+        self.renderer.flush()
+
+        if self.save:
+            for rank, pair in enumerate(pairs):
+                for leg, flight in (("outbound", pair.outbound), ("inbound", pair.inbound)):
+                    self.save_to_file(flight, pair=rank + 1, total=round(pair.price, 2), leg=leg)
+
+        return pairs
+
+    @staticmethod
+    def search_units(departure_iata: dict, destination_iata: dict, dates, adults: int = 1):
+        route = "%s-%s" % (next(iter(departure_iata.values()))["iata"], next(iter(destination_iata.values()))["iata"])
+        for date in dates:
+            yield {"adults": adults, "date": date, "departure": departure_iata, "destination": destination_iata,
+                   "route": route}
+
+    def batch_units(self, jobs: list):
+        # Every (route, date, passengers) once, with the union of the providers asked for it
+        units = batch.plan(jobs)
+
+        # Every location resolved once, shared by all the jobs
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            iatas = sorted({iata for unit in units for iata in (unit["departure"], unit["destination"])})
+            locations = dict(zip(iatas, executor.map(self.prepare_location, iatas)))
+
+        for iata in iatas:
+            if not locations[iata]:
+                self.renderer.message("[!] Invalid IATA %s, skipping its jobs" % iata)
+
+        return [{
+            "adults": unit["adults"], "date": unit["date"],
+            "departure": locations[unit["departure"]], "destination": locations[unit["destination"]],
+            "providers": [provider for provider in self.providers if provider.NAME in unit["providers"]],
+            "label": "%s %s %s" % (unit["departure"], unit["destination"], unit["date"]),
+            "route": "%s-%s" % (unit["departure"], unit["destination"]),
+            "extra": {"route": "%s-%s" % (unit["departure"], unit["destination"]), "passengers": unit["adults"]}
+        } for unit in units if locations[unit["departure"]] and locations[unit["destination"]]]
+
+    def start_batch(self, jobs: list, save: Union[bool, str] = False):
+        units = self.batch_units(jobs)
 
-            self.sheet.title = "%s %s (%s)" % (departure_iata["iata"], destination_iata["iata"],
-                                               datetime.datetime.now().strftime("%y-%m-%d %H.%M.%S"))
+        if save:
+            self.save = os.path.expanduser(save)
+            self.writer = writers.open_writer(self.save, "Batch (%s)" % datetime.datetime.now().strftime(
+                "%y-%m-%d %H.%M.%S"), columns=batch.COLUMNS)
 
         self.searching = True
-        print("Provider: %s" % self.provider.NAME)
-        while self.searching:
-            print("Searching for %s ..." % searching_date)
-            self.search(adults, searching_date.isoformat(), departure_iata, destination_iata)
+        self.renderer.message("Provider: %s" % ", ".join(provider.NAME for provider in self.providers))
+        self.renderer.message("Batch: %d jobs, %d searches" % (len(jobs), len(units)))
+
+        self.scan(iter(units))
+
+    def scan(self, units, collect=None):
+        # Keep at most `workers` units (a date of a route, fanned out to every provider and nearby airport)
+        # in flight and print them back in order
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.workers * sum(provider.MAX_CONCURRENCY for provider in self.providers),
+                thread_name_prefix="FlyWorker") as executor:
+            pending = collections.deque()
+            skipped = 0
+            while self.searching:
+                while len(pending) < self.workers:
+                    unit = next(units, None)
+                    if unit is None:
+                        break
+
+                    # Resumed scan: only the providers not done yet
+                    if self.checkpoint and not collect:
+                        unit_providers = self.pending_providers(unit)
+                        if not unit_providers:
+                            skipped += 1
+                            continue
+
+                        unit = dict(unit, providers=unit_providers)
+
+                    pending.append((unit, 0, None, self.submit_search(executor, unit["adults"], unit["date"],
+                                                                    unit["departure"], unit["destination"],
+                                                                    unit.get("providers"))))
+
+                if not pending:
+                    break
+
+                unit, attempt, previous, futures = pending.popleft()
+                search_resp, failed = self.merge_results(unit["date"], futures, previous)
+
+                # Failed providers are searched again right away (the throttle already slowed them down) and the
+                # unit keeps its place, so it is printed once, in order, with the results of every provider
+                if failed and attempt < self.REQUEUE_LIMIT and self.searching:
+                    self.renderer.message("Retrying %s on %s ..." % (unit.get("label", unit["date"]),
+                                                                     ", ".join(x.NAME for x in failed)))
+                    pending.appendleft((unit, attempt + 1, search_resp, self.submit_search(
+                        executor, unit["adults"], unit["date"], unit["departure"], unit["destination"], failed)))
+                    continue
+
+                if self.history and "route" in unit:
+                    self.history.record(search_resp, unit["route"])
+
+                self.renderer.message("Searching for %s ..." % unit.get("label", unit["date"]))
+                if collect:
+                    collect(unit, search_resp)
+
+                else:
+                    self.print_results(search_resp, **unit.get("extra", {}))
+                    if self.checkpoint:
+                        self.record_done(unit, [provider for provider in unit.get("providers") or self.providers
+                                                if provider not in failed])
+
+            for _, _, _, futures in pending:
+                for _, future in futures:
+                    future.cancel()
+
+        if skipped:
+            self.renderer.message("Checkpoint: %d searches already done, skipped" % skipped)
+
+        self.renderer.flush()
+        self.searching = False
 
-            if searching_date == stop_date:
-                self.searching = False
-                exit()
+    def pending_providers(self, unit: dict):
+        return [provider for provider in unit.get("providers") or self.providers
+                if not self.checkpoint.is_done(unit["route"], unit["date"], unit["adults"], provider.NAME)]
 
-            searching_date = searching_date + datetime.timedelta(1)
+    def record_done(self, unit: dict, done_providers: list):
+        # A search is checkpointed only once its rows are on disk: formats written whole (xlsx, parquet)
+        # record it when the file is closed
+        keys = [(unit["route"], unit["date"], unit["adults"], provider.NAME) for provider in done_providers]
+        if self.save:
+            if self.writer.closed:
+                return
+
+            if not self.writer.INCREMENTAL:
+                self.checkpoint_pending.extend(keys)
+                return
+
+            self.writer.flush()
+
+        for key in keys:
+            self.checkpoint.record(*key)
 
     def stop_search(self):
         self.searching = False
 
-        if self.save:
-            self.workbook.save(filename=self.save)
+        # Waiting and retrying requests stop now, the scan does not wait for the remaining units
+        for provider in self.providers:
+            provider.cancel()
 
-    def save_to_file(self, solution: dict):
-        if self.sheet.max_column > 1:
-            keys = list(x[0].value for x in self.sheet.iter_cols(max_row=1))
-            remaining_keys = list(set(keys) ^ set(solution.keys()))
+        if self.writer:
+            self.writer.close()
 
-        else:
-            keys = providers.FLIGHT_DEFAULT + list(set(solution.keys()) ^ set(providers.FLIGHT_DEFAULT))
-            remaining_keys = []
-            self.sheet.append(keys)
+        if self.checkpoint:
+            for key in self.checkpoint_pending:
+                self.checkpoint.record(*key)
 
-        row_data = []
-        for k in keys + remaining_keys:
-            v = solution.get(k, "")
-            row_data.append("\n".join(str(x) for x in v) if isinstance(v, (list, set, tuple)) else
-                            (str(v) if isinstance(v, dict) else v))
+            self.checkpoint.close()
 
-        self.sheet.append(row_data)
+    def save_to_file(self, solution, **extra):
+        with span("save"):
+            self.writer.write(solution, **extra)
 
 
 if __name__ == "__main__":
+    import sys
     import time
     import argparse
     import threading
@@ -127,9 +412,22 @@ if __name__ == "__main__":
     mutual_mode.add_argument("--search", action='store_true', help="Search on the selected provider")
     mutual_mode.add_argument("--autocomplete", nargs="+", help="Helper to find IATA of city and airport")
     mutual_mode.add_argument("--providers", action='store_true', help="List available providers")
+    mutual_mode.add_argument("--batch", type=str, metavar="ROUTES.yaml|csv",
+                             help="Search every job of a route manifest (see README)")
+    mutual_mode.add_argument("--work", type=str, metavar="QUEUE",
+                             help="Run a worker claiming searches from a work queue (see --queue)")
+    mutual_mode.add_argument("--queue-status", type=str, metavar="QUEUE",
+                             help="Show the work queue progress (and export its results with --save)")
+    mutual_mode.add_argument("--history-report", type=str, metavar="IATA-IATA",
+                             help="Print the cheapest price seen per day for a route (see --history)")
+    mutual_mode.add_argument("--preload-locations", nargs="+", metavar="WORD",
+                             help="Fill the offline location index with the autocomplete results of every WORD")
+    mutual_mode.add_argument("--serve", nargs='?', type=str, const="127.0.0.1:8080", metavar="[HOST:]PORT",
+                             help="Run a local HTTP/JSON search service (default %(const)s, see README)")
 
     search_group = parser.add_argument_group("search options")
-    search_group.add_argument("--provider", default="eDreams", choices=providers.PROVIDERS.keys())
+    search_group.add_argument("--provider", default="eDreams", metavar="PROVIDER[,PROVIDER...]|all",
+                              help="Provider to use, a comma separated list or `all` (default eDreams)")
 
     search_group.add_argument("--departure", "--from", "-f", type=str, metavar="IATA")
     search_group.add_argument("--destination", "--to", "-t", type=str, metavar="IATA")
@@ -137,6 +435,82 @@ if __name__ == "__main__":
     search_group.add_argument("--to-date", type=str, metavar="YYYY-MM-DD")
     search_group.add_argument("--passengers", metavar="#", default=1, type=int,
                               help="Number of adult passengers (default 1)")
+    search_group.add_argument("--cheapest", metavar="#", type=int,
+                              help="Use the provider price calendar and search only the # cheapest dates")
+    search_group.add_argument("--max-price", metavar="PRICE", type=float,
+                              help="Use the provider price calendar and search only dates under PRICE")
+    search_group.add_argument("--workers", "-w", metavar="#", default=1, type=int,
+                              help="Number of dates searched concurrently (default 1)")
+    search_group.add_argument("--nearby", action='store_true',
+                              help="Also search the other airports of the departure and destination cities")
+    search_group.add_argument("--full-query", action='store_true',
+                              help="Ask the provider for every field of the results, not only the ones shown")
+
+    cache_group = parser.add_argument_group("cache options")
+    cache_group_mutual = cache_group.add_mutually_exclusive_group()
+    cache_group_mutual.add_argument("--cache", type=str, metavar="PATH",
+                                    default=os.path.join(providers.CACHE_DIR, "results.sqlite"),
+                                    help="Search results cache (default %(default)s)")
+    cache_group_mutual.add_argument("--no-cache", action='store_true', help="Always query the provider")
+    cache_group.add_argument("--max-age", type=float, metavar="SECONDS",
+                             help="Reuse cached results younger than this (default depends on the date)")
+    cache_group.add_argument("--refresh", action='store_true', help="Ignore cached results, but update them")
+
+    queue_group = parser.add_argument_group("queue options")
+    queue_group.add_argument("--queue", type=str, metavar="QUEUE",
+                             help="With --batch: add the searches to a work queue instead of running them")
+    queue_group.add_argument("--lease", type=float, metavar="SECONDS", default=300,
+                             help="Seconds before a claimed search is given to another worker (default 300)")
+    queue_group.add_argument("--forever", action='store_true', help="Keep the worker waiting for new searches")
+
+    history_group = parser.add_argument_group("history options")
+    history_group.add_argument("--history", nargs='?', type=str, default=False,
+                               const=os.path.join(providers.CACHE_DIR, "history.sqlite"),
+                               help="Record every price seen in a price history (default %(const)s)")
+
+    filter_group = parser.add_argument_group("filter options")
+    filter_group.add_argument("--max-stops", metavar="#", type=int, help="Maximum number of stops")
+    filter_group.add_argument("--depart-between", metavar="HH:MM-HH:MM", type=str,
+                              help="Departure time window (local time, can wrap around midnight)")
+    filter_group.add_argument("--max-duration", metavar="DURATION", type=str,
+                              help="Maximum total travel time (e.g. 5h, 90m, 2:30)")
+    filter_group.add_argument("--max-layover", metavar="DURATION", type=str,
+                              help="Maximum total time between connecting flights")
+    filter_group.add_argument("--carrier", metavar="NAME[,NAME...]", type=str, help="Only these carriers")
+    filter_group.add_argument("--sort", metavar="KEY[,KEY...]", type=str,
+                              help="Order of the results: %s (prefix - to reverse, default price)" %
+                                   ", ".join(table.SORT_KEYS))
+
+    checkpoint_group = parser.add_argument_group("checkpoint options")
+    checkpoint_group.add_argument("--checkpoint", type=str, metavar="PATH",
+                                  help="Record every finished (route, date, provider) search in PATH")
+    checkpoint_group.add_argument("--resume", action='store_true',
+                                  help="With --checkpoint: skip the searches an interrupted run already finished")
+
+    round_trip_group = parser.add_argument_group("round trip options")
+    round_trip_group.add_argument("--round-trip", action='store_true',
+                                  help="With --search: pair the outbound dates (--date/--to-date) with the returns")
+    round_trip_group.add_argument("--min-stay", metavar="DAYS", default=1, type=int, help="Minimum stay (default 1)")
+    round_trip_group.add_argument("--max-stay", metavar="DAYS", default=7, type=int, help="Maximum stay (default 7)")
+    round_trip_group.add_argument("--min-gap", metavar="HOURS", default=2, type=float,
+                                  help="Minimum time between the outbound arrival and the return (default 2)")
+    round_trip_group.add_argument("--return-from", type=str, metavar="IATA",
+                                  help="Open-jaw: return from another airport (default --destination)")
+    round_trip_group.add_argument("--return-to", type=str, metavar="IATA",
+                                  help="Open-jaw: return to another airport (default --departure)")
+    round_trip_group.add_argument("--top", metavar="#", default=10, type=int,
+                                  help="Number of cheapest pairs shown (default 10)")
+
+    watch_group = parser.add_argument_group("watch options")
+    watch_group.add_argument("--watch", action='store_true',
+                             help="With --search or --batch: keep polling the dates and report price changes")
+    watch_group.add_argument("--interval", type=float, metavar="SECONDS", default=900,
+                             help="Base polling interval, shorter for close or volatile dates (default 900)")
+    watch_group.add_argument("--alert-below", type=float, metavar="PRICE", help="Alert when a price goes below")
+    watch_group.add_argument("--alert-drop", type=float, metavar="PERCENT", help="Alert when a price drops by")
+    watch_group.add_argument("--alerts-only", action='store_true', help="Report only the alerts, not every change")
+    watch_group.add_argument("--webhook", type=str, metavar="URL", help="Also POST every report as JSON to URL")
+    watch_group.add_argument("--alert-file", type=str, metavar="PATH", help="Also append every report to a JSONL file")
 
     output_group = parser.add_argument_group("output options")
     output_group_mutual = output_group.add_mutually_exclusive_group()
@@ -145,55 +519,282 @@ if __name__ == "__main__":
     output_group_mutual.add_argument("--list", action='store_true', help="Reduce verbosity")
 
     output_group.add_argument("--save", nargs='?', type=str, default=False, const="~/Desktop/FlyScannerTrips.xlsx",
-                              help="Save the search output on a Excel spreadsheet")
+                              help="Save the search output on a spreadsheet, the format is chosen by extension "
+                                   "(%s)" % ", ".join(writers.WRITERS.keys()))
+    output_group.add_argument("--format", default="pretty", choices=render.RENDERERS.keys(),
+                              help="Print the results for humans or as NDJSON/TSV lines, progress goes to stderr "
+                                   "(default pretty)")
+
+    diagnostics_group = parser.add_argument_group("diagnostics options")
+    diagnostics_group.add_argument("--metrics", type=str, metavar="PATH",
+                                   help="Write the timing, bytes and retries of every phase as Prometheus text on exit")
+    diagnostics_group.add_argument("--metrics-log", type=str, metavar="PATH",
+                                   help="Append one JSON line per request and phase to PATH")
+    diagnostics_group.add_argument("--profile", type=str, metavar="PATH",
+                                   help="Profile every thread and dump the pstats to PATH on exit")
 
     args = parser.parse_args()
+
+    try:
+        provider_names = providers.parse_providers(args.provider)
+
+    except ValueError as e:
+        parser.error("--provider: %s" % e)
+
+    try:
+        ranking = table.Ranking(
+            sort=table.parse_sort(args.sort) if args.sort else None,
+            max_stops=args.max_stops,
+            depart_between=table.parse_time_window(args.depart_between) if args.depart_between else None,
+            max_duration=table.parse_duration(args.max_duration) if args.max_duration else None,
+            max_layover=table.parse_duration(args.max_layover) if args.max_layover else None,
+            carriers=[x.strip() for x in args.carrier.split(",") if x.strip()] if args.carrier else None
+        )
+
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.full_query:
+        for provider_name in provider_names:
+            providers.PROVIDERS[provider_name].FULL_QUERY = True
+
+    # Keep stdout for the results when they are machine readable
+    console = sys.stdout if args.format == "pretty" else sys.stderr
+
+    if args.metrics_log:
+        import logging
+
+        metrics_handler = logging.FileHandler(args.metrics_log)
+        metrics_handler.setFormatter(logging.Formatter("%(message)s"))
+        logging.getLogger("flyscanner.metrics").addHandler(metrics_handler)
+        logging.getLogger("flyscanner.metrics").setLevel(logging.DEBUG)
+
+    if args.profile:
+        from providers.metrics import ThreadProfiler
+
+        profiler = ThreadProfiler()
+        try:
+            profiler.start()
+
+        except RuntimeError as e:
+            parser.error("--profile: %s" % e)
+
     print("\n"
           "    ________      _____                                 \n"
           "   / ____/ /_  __/ ___/_________ _____  ____  ___  _____\n"
           "  / /_  / / / / /\__ \/ ___/ __ `/ __ \/ __ \/ _ \/ ___/\n"
           " / __/ / / /_/ /___/ / /__/ /_/ / / / / / / /  __/ /    \n"
           "/_/   /_/\__, //____/\___/\__,_/_/ /_/_/ /_/\___/_/     \n"
-          "        /____/                                          \n")
+          "        /____/                                          \n", file=console)
 
+    search_target = None
     if args.autocomplete:
-        for suggestion_obj in providers.PROVIDERS[args.provider].autocomplete(" ".join(args.autocomplete)):
-            providers.PROVIDERS[args.provider].print_autocomplete(suggestion_obj)
-            print()
+        for provider_name in provider_names:
+            if len(provider_names) > 1:
+                print("Provider: %s" % provider_name)
+
+            provider = providers.PROVIDERS[provider_name]()
+            for suggestion_obj in provider.lookup(" ".join(args.autocomplete)):
+                provider.print_autocomplete(suggestion_obj)
+                print()
+
+    elif args.preload_locations:
+        for provider_name in provider_names:
+            provider = providers.PROVIDERS[provider_name]()
+            provider.preload_locations(args.preload_locations)
+            print("Provider: %s - %d locations" % (provider_name, len(provider.location_index().locations)))
 
     elif args.providers:
         print("Providers:\n  \u2022", "\n  \u2022 ".join(providers.PROVIDERS.keys()))
 
-    elif args.search:
-        if not all((args.departure, args.destination, args.date)):
+    elif args.history_report:
+        import history
+
+        price_history = history.PriceHistory(args.history or os.path.join(providers.CACHE_DIR, "history.sqlite"))
+        for travel_date, price, currency, provider_name, flight_key, last_seen in price_history.cheapest_per_day(
+                args.history_report.upper(), args.date, args.to_date):
+            print("  \u2022 %s: %.2f %s - %s - %s (seen %s)" % (
+                travel_date, price, currency, provider_name, flight_key,
+                datetime.datetime.fromtimestamp(last_seen).strftime("%Y-%m-%d %H:%M")))
+
+    elif args.queue_status:
+        import workqueue
+
+        queue = workqueue.WorkQueue(args.queue_status)
+        print("Queue:", ", ".join("%s %d" % x for x in sorted(queue.stats().items())) or "empty")
+
+        if args.save:
+            writer = writers.open_writer(args.save, "Queue (%s)" % datetime.datetime.now().strftime(
+                "%y-%m-%d %H.%M.%S"), columns=batch.COLUMNS)
+            for search_resp in queue.results():
+                for solution in search_resp["result"]:
+                    writer.write(solution, route="%s-%s" % (search_resp["departure"], search_resp["destination"]),
+                                 passengers=search_resp["adults"])
+
+            writer.close()
+            print("Saved:", args.save)
+
+    elif args.batch and args.queue:
+        import workqueue
+
+        try:
+            jobs = batch.load_manifest(args.batch, provider_names, args.passengers)
+
+        except (OSError, ValueError) as e:
+            parser.error("--batch: %s" % e)
+
+        added = workqueue.WorkQueue(args.queue, args.lease).add_jobs(jobs)
+        print("Queue: %d searches added" % added)
+
+    elif args.work:
+        import workqueue
+
+        if not args.no_cache:
+            import cache
+
+            search_cache = cache.SearchCache(args.cache, max_age=args.max_age, refresh=args.refresh)
+
+        else:
+            search_cache = None
+
+        worker = workqueue.Worker(workqueue.WorkQueue(args.work, args.lease), args.workers, search_cache)
+        search_target = worker.run
+        search_kwargs = {"forever": args.forever}
+        search_stop = worker.stop
+
+    elif args.search or args.batch or args.serve:
+        if args.batch:
+            try:
+                jobs = batch.load_manifest(args.batch, provider_names, args.passengers)
+
+            except (OSError, ValueError) as e:
+                parser.error("--batch: %s" % e)
+
+            provider_names = list(dict.fromkeys(name for job in jobs for name in job["providers"]))
+
+        elif args.serve:
+            serve_host, _, serve_port = args.serve.rpartition(":")
+            if not serve_port.isdigit():
+                parser.error("--serve: invalid port " + serve_port)
+
+        elif not all((args.departure, args.destination, args.date)):
             parser.error("--departure, --destination, --date required!")
 
         elif len(args.departure) != 3 or len(args.destination) != 3:
             parser.error("--departure and --destination must be IATA code (use --autocomplete to find them)")
 
-        if args.save:
-            import openpyxl
+        if args.resume and not args.checkpoint:
+            parser.error("--resume requires --checkpoint")
+
+        if args.round_trip and (args.batch or args.watch):
+            parser.error("--round-trip works with --search only")
+
+        if args.round_trip and not 0 <= args.min_stay <= args.max_stay:
+            parser.error("--min-stay must be between 0 and --max-stay")
+
+        if args.save and os.path.splitext(args.save)[1].lower() not in writers.WRITERS:
+            parser.error("--save: unsupported file type (choose from %s)" % ", ".join(writers.WRITERS.keys()))
+
+        if not args.no_cache:
+            import cache
+
+            search_cache = cache.SearchCache(args.cache, max_age=args.max_age, refresh=args.refresh)
+
+        else:
+            search_cache = None
+
+        if args.history or args.watch:
+            import history
+
+            price_history = history.PriceHistory(args.history or os.path.join(providers.CACHE_DIR, "history.sqlite"))
+
+        else:
+            price_history = None
+
+        fly = FlyScanner(provider_names, args.all, not args.list, args.workers, search_cache, price_history,
+                         args.format, args.nearby, ranking,
+                         checkpoint.Checkpoint(args.checkpoint, args.resume) if args.checkpoint else None)
+        search_stop = fly.stop_search
 
-        fly = FlyScanner(args.provider, args.all, not args.list)
+        if args.serve:
+            import server
 
-        departure = fly.prepare_location(args.departure)
-        if not departure:
-            parser.error("--departure: invalid IATA " + args.departure)
+            service = server.SearchServer(fly, serve_host or "127.0.0.1", int(serve_port))
+            print("Serving on", service.url, file=console)
 
-        destination = fly.prepare_location(args.destination)
-        if not destination:
-            parser.error("--destination: invalid IATA " + args.destination)
+            search_target = service.serve_forever
+            search_kwargs = {}
+            search_stop = service.stop
 
-        searching_th = threading.Thread(name="FlySearching",
-                                        target=fly.start_search,
-                                        kwargs={
-                                            "departure_iata": departure,
-                                            "destination_iata": destination,
-                                            "from_date": args.date,
-                                            "to_date": args.to_date,
-                                            "adults": args.passengers,
-                                            "save":  args.save
-                                        })
+        elif args.watch:
+            import watch
+
+            if args.batch:
+                watch_units = fly.batch_units(jobs)
+
+            else:
+                departure = fly.prepare_location(args.departure)
+                destination = fly.prepare_location(args.destination)
+                if not departure or not destination:
+                    parser.error("--departure/--destination: invalid IATA")
+
+                watch_units = list(fly.search_units(departure, destination,
+                                                    fly.iter_dates(args.date, args.to_date or args.date),
+                                                    args.passengers))
+
+            watch_sinks = [watch.StdoutSink()]
+            if args.webhook:
+                watch_sinks.append(watch.WebhookSink(args.webhook))
+
+            if args.alert_file:
+                watch_sinks.append(watch.FileSink(os.path.expanduser(args.alert_file)))
+
+            watcher = watch.Watcher(fly, price_history, args.interval, args.alert_below, args.alert_drop,
+                                    watch_sinks, args.alerts_only)
+            search_target = watcher.run
+            search_kwargs = {"units": watch_units}
+            search_stop = watcher.stop
+
+        elif args.batch:
+            search_target = fly.start_batch
+            search_kwargs = {"jobs": jobs, "save": args.save}
+
+        else:
+            departure = fly.prepare_location(args.departure)
+            if not departure:
+                parser.error("--departure: invalid IATA " + args.departure)
+
+            destination = fly.prepare_location(args.destination)
+            if not destination:
+                parser.error("--destination: invalid IATA " + args.destination)
+
+            return_locations = {}
+            for option in ("return_from", "return_to"):
+                if args.round_trip and getattr(args, option):
+                    return_locations[option] = fly.prepare_location(getattr(args, option))
+                    if not return_locations[option]:
+                        parser.error("--%s: invalid IATA %s" % (option.replace("_", "-"), getattr(args, option)))
+
+            search_target = fly.start_search
+            search_kwargs = {
+                "departure_iata": departure,
+                "destination_iata": destination,
+                "from_date": args.date,
+                "to_date": args.to_date,
+                "adults": args.passengers,
+                "save":  args.save,
+                "cheapest": args.cheapest,
+                "max_price": args.max_price,
+                "round_trip": args.round_trip,
+                "min_stay": args.min_stay,
+                "max_stay": args.max_stay,
+                "min_gap": args.min_gap,
+                "top": args.top,
+                **return_locations
+            }
+
+    if search_target:
+        searching_th = threading.Thread(name="FlySearching", target=search_target, kwargs=search_kwargs)
 
         searching_th.start()
         while searching_th.is_alive():
@@ -203,7 +804,7 @@ if __name__ == "__main__":
             except KeyboardInterrupt:
                 break
 
-        fly.stop_search()
+        search_stop()
 
         try:
             searching_th.join()
@@ -211,4 +812,14 @@ if __name__ == "__main__":
         except KeyboardInterrupt:
             pass
 
-    print("Bye!")
+    if args.metrics:
+        from providers.metrics import METRICS
+
+        METRICS.write_prometheus(args.metrics)
+        print("Metrics:", args.metrics, file=console)
+
+    if args.profile:
+        profiler.stop(args.profile, console).sort_stats("cumulative").print_stats(15)
+        print("Profile:", args.profile, "(python -m pstats %s)" % args.profile, file=console)
+
+    print("Bye!", file=console)
@@ -0,0 +1,108 @@
+import os
+import time
+import sqlite3
+import threading
+
+import providers
+
+
+class PriceHistory:
+    def __init__(self, path: str = os.path.join(providers.CACHE_DIR, "history.sqlite")):
+        self.path = os.path.expanduser(path)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._latest = {}
+
+        self.db = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS flights ("
+                        "id INTEGER PRIMARY KEY, provider TEXT, route TEXT, travel_date TEXT, flight_key TEXT, "
+                        "carrier TEXT, UNIQUE (provider, route, travel_date, flight_key))")
+        self.db.execute("CREATE INDEX IF NOT EXISTS flights_route ON flights (route, travel_date)")
+
+        # Delta encoded: a new row only when the price changes, otherwise `last_seen` moves forward
+        self.db.execute("CREATE TABLE IF NOT EXISTS prices ("
+                        "flight_id INTEGER, observed_at REAL, last_seen REAL, price REAL, currency TEXT, "
+                        "PRIMARY KEY (flight_id, observed_at)) WITHOUT ROWID")
+
+    @staticmethod
+    def flight_key(flight):
+        # The whole itinerary: itineraries sharing their first flight connect differently
+        segments = flight.stops_detail or [flight]
+        return "%s %s" % (flight.carrier, " | ".join("%s %s > %s %s" % (
+            segment.departure_location, segment.departure_date.isoformat(), segment.arrival_location,
+            segment.arrival_date.isoformat()) for segment in segments))
+
+    def _flight_id(self, flight, route: str, travel_date: str):
+        key = (flight.provider, route, travel_date, self.flight_key(flight))
+        self.db.execute("INSERT OR IGNORE INTO flights (provider, route, travel_date, flight_key, carrier) "
+                        "VALUES (?, ?, ?, ?, ?)", key + (flight.carrier,))
+
+        return self.db.execute("SELECT id FROM flights WHERE provider = ? AND route = ? AND travel_date = ? "
+                               "AND flight_key = ?", key).fetchone()[0]
+
+    def _latest_price(self, flight_id: int):
+        if flight_id not in self._latest:
+            row = self.db.execute("SELECT observed_at, price FROM prices WHERE flight_id = ? "
+                                  "ORDER BY observed_at DESC LIMIT 1", (flight_id,)).fetchone()
+            self._latest[flight_id] = tuple(row) if row else None
+
+        return self._latest[flight_id]
+
+    def record(self, search_resp: dict, route: str, observed_at: float = None):
+        observed_at = observed_at or time.time()
+
+        # Merged results list the flights fetched now, the cached ones are not observed again.
+        # The same itinerary listed twice (fare options, nearby searches): keep the cheapest
+        cheapest = {}
+        for flight in search_resp.get("fetched", search_resp["result"]):
+            key = flight.provider, self.flight_key(flight)
+            if key not in cheapest or flight.price < cheapest[key].price:
+                cheapest[key] = flight
+
+        changes = []
+        with self._lock, self.db:
+            for flight in cheapest.values():
+                flight_id = self._flight_id(flight, route, search_resp["date"])
+                latest = self._latest_price(flight_id)
+
+                if latest and latest[1] == flight.price:
+                    self.db.execute("UPDATE prices SET last_seen = ? WHERE flight_id = ? AND observed_at = ?",
+                                    (observed_at, flight_id, latest[0]))
+                    continue
+
+                self.db.execute("INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?, ?)",
+                                (flight_id, observed_at, observed_at, flight.price, flight.price_currency))
+                self._latest[flight_id] = (observed_at, flight.price)
+                changes.append((flight, latest[1] if latest else None))
+
+        return changes
+
+    # Query
+    def price_over_time(self, provider: str, route: str, travel_date: str, flight_key: str):
+        with self._lock:
+            return self.db.execute("SELECT p.observed_at, p.last_seen, p.price, p.currency FROM prices p "
+                                   "JOIN flights f ON f.id = p.flight_id WHERE f.provider = ? AND f.route = ? "
+                                   "AND f.travel_date = ? AND f.flight_key = ? ORDER BY p.observed_at",
+                                   (provider, route, travel_date, flight_key)).fetchall()
+
+    def changes_since(self, route: str, travel_date: str, since: float):
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM prices p JOIN flights f ON f.id = p.flight_id "
+                                   "WHERE f.route = ? AND f.travel_date = ? AND p.observed_at >= ? AND EXISTS ("
+                                   "SELECT 1 FROM prices q WHERE q.flight_id = p.flight_id "
+                                   "AND q.observed_at < p.observed_at)",
+                                   (route, travel_date, since)).fetchone()[0]
+
+    def cheapest_per_day(self, route: str, from_date: str = None, to_date: str = None, since: float = None):
+        with self._lock:
+            return self.db.execute("SELECT f.travel_date, MIN(p.price), p.currency, f.provider, f.flight_key, "
+                                   "p.last_seen FROM prices p JOIN flights f ON f.id = p.flight_id "
+                                   "WHERE f.route = ? AND f.travel_date >= ? AND f.travel_date <= ? "
+                                   "AND p.last_seen >= ? GROUP BY f.travel_date ORDER BY f.travel_date",
+                                   (route, from_date or "", to_date or "9999", since or 0)).fetchall()
+
+    def close(self):
+        with self._lock:
+            self.db.close()
@@ -0,0 +1,97 @@
+import heapq
+import bisect
+import datetime
+from dataclasses import dataclass
+
+import providers
+from providers.models import Flight
+
+# Saved rows: both legs of every pair, ranked
+COLUMNS = ["pair", "total", "leg"] + providers.FLIGHT_DEFAULT
+
+
+@dataclass(slots=True)
+class Pair:
+    outbound: Flight
+    inbound: Flight
+
+    @property
+    def price(self):
+        return self.outbound.price + self.inbound.price
+
+    @property
+    def price_currency(self):
+        return self.outbound.price_currency
+
+    @property
+    def stay(self):
+        return (local(self.inbound.departure_date).date() - local(self.outbound.arrival_date).date()).days
+
+    def to_dict(self):
+        return {"price": round(self.price, 2), "price_currency": self.price_currency, "stay": self.stay,
+                "outbound": self.outbound.to_dict(), "inbound": self.inbound.to_dict()}
+
+
+def local(date: datetime.datetime):
+    # Providers mix naive and UTC-marked local times: compare the wall clock
+    return date.replace(tzinfo=None)
+
+
+class RangeMin:
+    # Sparse table: index of the minimum of any values[lo:hi] in O(1)
+    def __init__(self, values: list):
+        self.values = values
+        self.table = [list(range(len(values)))]
+
+        span = 1
+        while span * 2 <= len(values):
+            previous = self.table[-1]
+            self.table.append([a if values[a] <= values[b] else b for a, b in zip(previous, previous[span:])])
+            span *= 2
+
+    def argmin(self, lo: int, hi: int):
+        level = (hi - lo).bit_length() - 1
+        a = self.table[level][lo]
+        b = self.table[level][hi - (1 << level)]
+        return a if self.values[a] <= self.values[b] else b
+
+
+def top_pairs(outbound: list, inbound: list, min_stay: int = 0, max_stay: int = 30,
+              min_gap: datetime.timedelta = datetime.timedelta(hours=2), top: int = 10):
+    # The valid returns of an outbound flight are a contiguous range of the returns sorted by departure:
+    # keep the cheapest of every range in a heap and split the range around it when it is popped,
+    # so only `top` pairs (plus two candidates each) are ever built
+    pairs = []
+    for currency in {flight.price_currency for flight in outbound} & {flight.price_currency for flight in inbound}:
+        returns = sorted((flight for flight in inbound if flight.price_currency == currency),
+                         key=lambda flight: local(flight.departure_date))
+        departures = [local(flight.departure_date) for flight in returns]
+        cheapest = RangeMin([flight.price for flight in returns])
+
+        heap = []
+
+        def push(i: int, lo: int, hi: int):
+            if lo < hi:
+                j = cheapest.argmin(lo, hi)
+                heapq.heappush(heap, (outbound[i].price + returns[j].price, i, lo, hi, j))
+
+        for i, flight in enumerate(outbound):
+            if flight.price_currency != currency:
+                continue
+
+            arrival = local(flight.arrival_date)
+            arrival_day = datetime.datetime.combine(arrival.date(), datetime.time())
+            push(i,
+                 bisect.bisect_left(departures, max(arrival + min_gap, arrival_day + datetime.timedelta(min_stay))),
+                 bisect.bisect_left(departures, arrival_day + datetime.timedelta(max_stay + 1)))
+
+        found = 0
+        while heap and found < top:
+            _, i, lo, hi, j = heapq.heappop(heap)
+            pairs.append(Pair(outbound[i], returns[j]))
+            found += 1
+
+            push(i, lo, j)
+            push(i, j + 1, hi)
+
+    return heapq.nsmallest(top, pairs, key=lambda pair: pair.price)
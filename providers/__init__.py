@@ -1,4 +1,11 @@
+import os
+import threading
+import importlib
+import collections.abc
+
 # Defaults
+CACHE_DIR = os.path.expanduser("~/.cache/flyscanner")
+
 HEADER_DEFAULT = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
                   "Chrome/98.0.4758.82 Safari/537.36",
@@ -8,6 +15,7 @@ HEADER_DEFAULT = {
 }
 
 FLIGHT_DEFAULT = [
+    "provider",
     "price",
     "price_currency",
     "departure_date",
@@ -23,13 +31,98 @@ FLIGHT_DEFAULT = [
 ]
 
 
-# Import classes for __all__
-from .eDreams import eDreams
-from .ryanair import Ryanair
+# Errors
+class ProviderError(Exception):
+    pass
+
+
+class ProviderBlocked(ProviderError):
+    pass
+
+
+class SearchCancelled(Exception):
+    pass
+
+
+# Registry, a provider module (and requests with it) is imported the first time its class is used
+class ProviderRegistry(collections.abc.Mapping):
+    ENTRY_POINT_GROUP = "flyscanner.providers"
+
+    def __init__(self, providers: dict):
+        # name -> "module:Class" or the class itself
+        self._providers = dict(providers)
+        self._entry_points_loaded = False
+        self._lock = threading.RLock()
+
+    def _load_entry_points(self):
+        # Third-party packages declare [project.entry-points."flyscanner.providers"] Name = "module:Class"
+        import importlib.metadata
+
+        with self._lock:
+            if self._entry_points_loaded:
+                return
+
+            for entry_point in importlib.metadata.entry_points(group=self.ENTRY_POINT_GROUP):
+                self._providers.setdefault(entry_point.name, entry_point.value)
+
+            self._entry_points_loaded = True
+
+    def register(self, name: str, provider):
+        with self._lock:
+            self._providers[name] = provider
+
+    def __getitem__(self, name: str):
+        if name not in self._providers:
+            self._load_entry_points()
+
+        with self._lock:
+            provider = self._providers[name]
+            if isinstance(provider, str):
+                module_name, _, class_name = provider.partition(":")
+                provider = self._providers[name] = getattr(importlib.import_module(module_name), class_name)
+
+            return provider
+
+    def __contains__(self, name):
+        if name not in self._providers:
+            self._load_entry_points()
+
+        return name in self._providers
+
+    def __iter__(self):
+        self._load_entry_points()
+        return iter(list(self._providers))
+
+    def __len__(self):
+        self._load_entry_points()
+        return len(self._providers)
+
+
+PROVIDERS = ProviderRegistry({
+    "eDreams": "providers.eDreams:eDreams",
+    "Ryanair": "providers.ryanair:Ryanair"
+})
+
+
+def register_provider(name: str, provider):
+    # `provider` is a Provider subclass or its "module:Class" path
+    PROVIDERS.register(name, provider)
+
+
+def parse_providers(value: str):
+    if value.strip().lower() == "all":
+        return list(PROVIDERS.keys())
+
+    names = [x.strip() for x in value.split(",") if x.strip()]
+    if not names:
+        raise ValueError("no provider selected")
+
+    for name in names:
+        if name not in PROVIDERS:
+            raise ValueError("invalid provider %s (choose from %s)" % (name, ", ".join(PROVIDERS.keys())))
+
+    return list(dict.fromkeys(names))
 
-PROVIDERS = {
-    eDreams.NAME: eDreams,
-    Ryanair.NAME: Ryanair
-}
 
-__all__ = ["PROVIDERS", "HEADER_DEFAULT"]
+__all__ = ["PROVIDERS", "CACHE_DIR", "HEADER_DEFAULT", "FLIGHT_DEFAULT", "ProviderError", "ProviderBlocked",
+           "SearchCancelled", "parse_providers", "register_provider"]
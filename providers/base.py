@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import random
+import threading
+import concurrent.futures
+
+import requests
+import requests.adapters
+
+from providers import CACHE_DIR, HEADER_DEFAULT, ProviderError
+from providers.throttle import Throttle
+from providers.metrics import span
+from providers.locations import LocationIndex
+
+# Connection pool
+POOL_SIZE = 32
+
+_shared_executor = None
+_shared_lock = threading.Lock()
+
+
+def new_session(pool_size: int = POOL_SIZE):
+    session = requests.Session()
+    session.headers = HEADER_DEFAULT.copy()
+
+    # Keep-alive connections, at most `pool_size` per host (callers wait for a free one)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    # Debug
+    # session.proxies = {"http": "http://127.0.0.1:8080", "https": "https://127.0.0.1:8080"}
+    # session.verify = False
+
+    return session
+
+
+def shared_executor():
+    global _shared_executor
+
+    with _shared_lock:
+        if _shared_executor is None:
+            _shared_executor = concurrent.futures.ThreadPoolExecutor(max_workers=POOL_SIZE,
+                                                                     thread_name_prefix="FlyIO")
+
+        return _shared_executor
+
+
+class Provider:
+    NAME = None
+
+    _location_index = None
+
+    # Static
+    BASE_URL = None
+
+    # Ask the provider for every field, not only the ones parsed into Flight
+    FULL_QUERY = False
+
+    # Limits
+    MAX_CONCURRENCY = 1
+    RATE = None
+
+    # Seconds to connect and between two bytes of the answer, so a cancelled search never waits on a stalled socket
+    CONNECT_TIMEOUT = 5
+    TIMEOUT = 30
+
+    # Retry
+    MAX_RETRIES = 3
+    BACKOFF_BASE = 1.0
+    BACKOFF_MAX = 30.0
+    RETRY_STATUS = (500, 502, 503, 504)
+    BLOCKED_STATUS = (403, 429)
+
+    # Session, reused across runs until it expires
+    SESSION_TTL = 30 * 60
+    SESSION_HEADERS = ("Referer",)
+    SESSION_EXPIRED_STATUS = (401, 403, 419, 440)
+
+    def __init__(self, keep_raw: bool = False):
+        self.keep_raw = keep_raw
+
+        self.session = new_session()
+        self.cancelled = threading.Event()
+        self.throttle = Throttle(self.MAX_CONCURRENCY, self.RATE, cancelled=self.cancelled)
+        self.retries = 0
+
+        self._session_lock = threading.Lock()
+        self._session_generation = 0
+        self._session_ready = False
+
+    def _init_cookies(self):
+        pass
+
+    def cancel(self):
+        # Waiting and retrying requests raise SearchCancelled, the ones on the wire end within the timeouts
+        self.cancelled.set()
+
+    # Session
+    @property
+    def session_path(self):
+        return os.path.join(CACHE_DIR, "session-%s.json" % self.NAME)
+
+    def load_session(self):
+        try:
+            with open(self.session_path) as f:
+                data = json.load(f)
+
+        except (OSError, ValueError):
+            return False
+
+        if time.time() - data.get("saved_at", 0) > self.SESSION_TTL:
+            return False
+
+        self.session.cookies.clear()
+        for cookie in data["cookies"]:
+            self.session.cookies.set(cookie["name"], cookie["value"], domain=cookie["domain"],
+                                     path=cookie["path"], expires=cookie["expires"], secure=cookie["secure"])
+
+        self.session.headers.update(data["headers"])
+        return True
+
+    def save_session(self):
+        os.makedirs(os.path.dirname(self.session_path), exist_ok=True)
+
+        tmp_path = "%s.%d.tmp" % (self.session_path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "saved_at": time.time(),
+                "cookies": [{"name": c.name, "value": c.value, "domain": c.domain, "path": c.path,
+                             "expires": c.expires, "secure": c.secure} for c in self.session.cookies],
+                "headers": {k: self.session.headers[k] for k in self.SESSION_HEADERS if k in self.session.headers}
+            }, f)
+
+        os.replace(tmp_path, self.session_path)
+
+    def ensure_session(self):
+        # The session is bootstrapped by the first request, not when the provider is created
+        if self._session_ready:
+            return
+
+        generation = self._session_generation
+        with self._session_lock:
+            if self._session_ready:
+                return
+
+            self._session_ready = self.load_session()
+
+        if not self._session_ready:
+            self.refresh_session(generation)
+
+    def refresh_session(self, generation: int = None):
+        with self._session_lock:
+            # Another thread already refreshed the session we saw failing
+            if generation is not None and generation != self._session_generation:
+                return
+
+            with span("init_cookies", self.NAME):
+                self._init_cookies()
+
+            self.save_session()
+            self._session_generation += 1
+            self._session_ready = True
+
+    def session_expired(self, resp: requests.Response):
+        return resp.status_code in self.SESSION_EXPIRED_STATUS
+
+    def is_blocked(self, resp: requests.Response):
+        return resp.status_code in self.BLOCKED_STATUS
+
+    def backoff(self, attempt: int):
+        # Full jitter: spread the retries of concurrent workers
+        return random.uniform(0, min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** attempt))
+
+    def send(self, method: str, url: str, session_check: bool = False, **kwargs):
+        kwargs.setdefault("timeout", (self.CONNECT_TIMEOUT, self.TIMEOUT))
+
+        resp = None
+        error = None
+        with span("http", self.NAME) as info:
+            for attempt in range(self.MAX_RETRIES + 1):
+                with self.throttle:
+                    try:
+                        resp = self.session.request(method, url, **kwargs)
+                        error = None
+
+                        info["bytes"] += len(resp.content)
+                        info["server_seconds"] += resp.elapsed.total_seconds()
+
+                    except requests.RequestException as e:
+                        resp = None
+                        error = e
+
+                if resp is not None:
+                    # 403 is both: the first one goes back to request() to refresh the session
+                    if session_check and self.session_expired(resp):
+                        return resp
+
+                    if self.is_blocked(resp):
+                        self.throttle.on_throttled()
+
+                    elif resp.status_code not in self.RETRY_STATUS:
+                        self.throttle.on_success()
+                        return resp
+
+                if attempt < self.MAX_RETRIES:
+                    self.retries += 1
+                    info["retries"] += 1
+                    self.throttle.wait(self.backoff(attempt))
+
+            if error is not None:
+                raise ProviderError("request failed: %s" % error) from error
+
+        return resp
+
+    def request(self, method: str, url: str, **kwargs):
+        self.ensure_session()
+
+        generation = self._session_generation
+        resp = self.send(method, url, session_check=True, **kwargs)
+
+        if self.session_expired(resp):
+            # Still refused with a fresh session: a block, throttled and retried
+            self.refresh_session(generation)
+            resp = self.send(method, url, **kwargs)
+
+        return resp
+
+    # Sync API
+    def prepare_location(self, location: dict):
+        raise NotImplementedError
+
+    def nearby_locations(self, location: dict):
+        # Locations to search instead of `location` to cover every airport around it
+        return [location]
+
+    @staticmethod
+    def query_key(location: dict):
+        # Locations with the same key are the same search for the provider
+        return location["iata"]
+
+    def search(self, num_adults: int, date: str, departure: dict, destination: dict):
+        raise NotImplementedError
+
+    def price_calendar(self, departure: dict, destination: dict, date: str):
+        # Cheapest price per date ({"YYYY-MM-DD": price}) in one request, None when not supported
+        return None
+
+    def autocomplete(self, search_word: str):
+        raise NotImplementedError
+
+    # Locations, resolved offline once they have been seen in an autocomplete response
+    @classmethod
+    def location_index(cls):
+        with _shared_lock:
+            if cls.__dict__.get("_location_index") is None:
+                cls._location_index = LocationIndex(cls.NAME)
+
+            return cls._location_index
+
+    @classmethod
+    def iter_locations(cls, suggestions: list):
+        for suggestion in suggestions:
+            yield suggestion["iata"], suggestion
+            yield from cls.iter_locations(suggestion.get("relatedLocations") or [])
+
+    def lookup(self, search_word: str):
+        index = self.location_index()
+
+        suggestions = index.query(search_word)
+        if suggestions is None:
+            # Through send(): timeouts, retries, the throttle and cancel apply like to a search
+            suggestions = self.autocomplete(search_word)
+            index.add(search_word, suggestions, self.iter_locations(suggestions))
+
+        return suggestions
+
+    def resolve_location(self, iata: str):
+        location = self.location_index().get(iata)
+        if location is None:
+            for found_iata, found_location in self.iter_locations(self.lookup(iata)):
+                if found_iata == iata:
+                    return found_location
+
+        return location
+
+    def preload_locations(self, search_words: list):
+        return list(shared_executor().map(self.lookup, search_words))
@@ -1,10 +1,13 @@
 import datetime
-import requests
 
-from providers import HEADER_DEFAULT
+from providers import HEADER_DEFAULT, ProviderError, ProviderBlocked
+from providers.base import Provider
+from providers.models import Flight, Segment, Discount
+from providers.metrics import span
+from providers.jsonlib import loads
 
 
-class eDreams:
+class eDreams(Provider):
     NAME = "eDreams"
 
     # Static
@@ -13,6 +16,19 @@ class eDreams:
     VISITOR_PATH = "/travel/service/frontendapi/getVisitInformation"
 
     GRAPHQL_PATH = "/frontend-api/service/graphql"
+    # Only the fields read by parse_itineraries
+    GRAPHQL_BODY_LEAN = {
+        "query": "query searchQuery($searchRequest: SearchRequest!) {\n  search(searchRequest: $searchRequest) {\n"
+                 "    itineraries {\n      fees {\n        price {\n          amount\n          currency\n        }\n"
+                 "        type {\n          id\n        }\n      }\n      legs {\n        segments {\n"
+                 "          carrier {\n            name\n          }\n          sections {\n"
+                 "            departureDate\n            arrivalDate\n            departure {\n"
+                 "              ...SectionLocation\n            }\n            destination {\n"
+                 "              ...SectionLocation\n            }\n          }\n        }\n      }\n    }\n  }\n}\n\n"
+                 "fragment SectionLocation on Location {\n  iata\n  cityName\n  name\n  countryName\n"
+                 "  locationType\n}\n"}
+
+    # Everything the website asks for, used with --full-query or keep_raw
     GRAPHQL_BODY = {
         "query": "query searchQuery($searchRequest: SearchRequest!) {\n  search(searchRequest: $searchRequest) {\n"
                  "    searchId\n    searchCode {\n      code\n      message\n    }\n    defaultFeeType {\n      name\n"
@@ -45,30 +61,34 @@ class eDreams:
     AUTOCOMPLETE_PATH = "/frontend-home/service/geo/autocomplete;searchWord={};departureOrArrival=ARRIVAL;" \
                         "addSearchByCountry=true;addSearchByRegion=true;nearestLocations=true;product=FLIGHT"
 
-    # Graphic
-    IMG_URL = "https://www.edreams.it/images/onefront/bluestone/ED/OpenGraph.png"
-
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers = HEADER_DEFAULT.copy()
+    # Limits
+    MAX_CONCURRENCY = 4
+    RATE = 5.0
 
-        # Debug
-        # self.session.proxies = {"http": "http://127.0.0.1:8080", "https": "https://127.0.0.1:8080"}
-        # self.session.verify = False
+    # Session
+    SESSION_HEADERS = ("Referer", "X-Visit", "X-Of1jsessionid")
 
-        self.__init_cookies()
+    # Graphic
+    IMG_URL = "https://www.edreams.it/images/onefront/bluestone/ED/OpenGraph.png"
 
-    def __init_cookies(self):
+    def _init_cookies(self):
         self.session.cookies.clear()
 
-        resp_home = self.session.get(self.BASE_URL)
+        resp_home = self.send("GET", self.BASE_URL)
         if resp_home.status_code != 200:
-            raise Exception("invalid response: %s" % resp_home)
+            raise ProviderError("invalid response: %s" % resp_home)
 
         self.session.headers["Referer"] = self.BASE_URL
-        resp_visitor = self.session.get(self.BASE_URL + self.VISITOR_PATH)
+        resp_visitor = self.send("GET", self.BASE_URL + self.VISITOR_PATH)
         if resp_visitor.status_code != 200:
-            raise Exception("invalid response: %s" % resp_visitor)
+            raise ProviderError("invalid response: %s" % resp_visitor)
+
+        self.session.headers["X-Visit"] = self.session.cookies["viI"]
+        self.session.headers["X-Of1jsessionid"] = self.session.cookies["OF1JSESSIONID"]
+
+    def session_expired(self, resp):
+        return super().session_expired(resp) or \
+            ("viI" not in self.session.cookies or "OF1JSESSIONID" not in self.session.cookies)
 
     # Locations
     def prepare_location(self, location: dict):
@@ -76,14 +96,23 @@ class eDreams:
             return False
 
         if "geoNodeId" not in location or not location["geoNodeId"]:
-            for autocomplete in self.autocomplete(location["iata"]):
-                if autocomplete["iata"] == location["iata"]:
-                    return autocomplete
-
-            return False
+            return self.resolve_location(location["iata"]) or False
 
         return location
 
+    def nearby_locations(self, location: dict):
+        # A city is expanded to all its airports by the search itself: one query covers them all
+        for suggestion in self.lookup(location.get("city") or location["iata"]):
+            if suggestion.get("geoNodeType") == "CITY" and (suggestion["iata"] == location["iata"] or any(
+                    related["iata"] == location["iata"] for related in suggestion.get("relatedLocations") or [])):
+                return [suggestion]
+
+        return [location]
+
+    @staticmethod
+    def query_key(location: dict):
+        return location["geoNodeId"]
+
     @staticmethod
     def parse_location(location):
         return " - ".join(location[x] for x in ["name", "cityName", "countryName", "locationType", "iata"]
@@ -92,7 +121,7 @@ class eDreams:
     # Search
     # noinspection PyTypeChecker
     def search(self, num_adults: int, date: str, departure: dict, destination: dict):
-        graphql_body = self.GRAPHQL_BODY.copy()
+        graphql_body = (self.GRAPHQL_BODY if self.FULL_QUERY or self.keep_raw else self.GRAPHQL_BODY_LEAN).copy()
         graphql_body["variables"] = {
             "searchRequest": {
                 "buyPath": 71, "tripType": "ONE_WAY",
@@ -107,18 +136,25 @@ class eDreams:
             }
         }
 
-        self.session.headers["X-Visit"] = self.session.cookies["viI"]
-        self.session.headers["X-Of1jsessionid"] = self.session.cookies["OF1JSESSIONID"]
-        self.session.headers["Referer"] = self.BASE_URL + "/travel/"
-        resp_search = self.session.post(self.BASE_URL + self.GRAPHQL_PATH, json=graphql_body)
-        if resp_search.status_code != 200:
-            raise Exception("invalid response: %s" % resp_search)
+        resp_search = self.request("POST", self.BASE_URL + self.GRAPHQL_PATH, json=graphql_body,
+                                   headers={"Referer": self.BASE_URL + "/travel/"})
+
+        if self.is_blocked(resp_search):
+            raise ProviderBlocked("blocked: %s" % resp_search)
 
-        search_data = resp_search.json()["data"]["search"]["itineraries"]
+        elif resp_search.status_code != 200:
+            raise ProviderError("invalid response: %s" % resp_search)
 
-        if not len(search_data):
-            return {"date": date, "result": []}
+        with span("decode", self.NAME):
+            search_data = loads(resp_search.content)["data"]["search"]["itineraries"]
 
+        with span("parse", self.NAME):
+            result = self.parse_itineraries(search_data)
+
+        return {"date": date, "result": sorted(result, key=lambda i: i.price)}
+
+    def parse_itineraries(self, search_data: list):
+        result = []
         for itinerary in search_data:
             price = None
             price_currency = None
@@ -130,20 +166,13 @@ class eDreams:
                     price_currency = fee["price"]["currency"]
 
                 else:
-                    discounts.append({"price": fee["price"]["amount"],
-                                      "price_currency": fee["price"]["currency"],
-                                      "reason": fee["type"]["id"]})
+                    discounts.append(Discount(fee["price"]["amount"], fee["price"]["currency"], fee["type"]["id"]))
 
-            trip_departure = None
-            trip_arrival = None
             trip_departure_date = None
             trip_arrival_date = None
             trip_stops = []
             trip_stops_duration = datetime.timedelta()
             for sections in itinerary["legs"][0]["segments"][0]["sections"]:
-                if not trip_departure:
-                    trip_departure = self.parse_location(sections["departure"])
-
                 section_departure_date = datetime.datetime.fromisoformat(
                     sections["departureDate"].replace('Z', '+00:00')
                 )
@@ -153,58 +182,86 @@ class eDreams:
                 if trip_arrival_date:
                     trip_stops_duration += section_departure_date - trip_arrival_date
 
-                trip_arrival = self.parse_location(sections["destination"])
                 trip_arrival_date = datetime.datetime.fromisoformat(sections["arrivalDate"].replace('Z', '+00:00'))
-                trip_stops.append({
-                    "departure_location": self.parse_location(sections["departure"]),
-                    "arrival_location": self.parse_location(sections["destination"]),
-                    "departure_date": sections["departureDate"],
-                    "arrival_date": sections["arrivalDate"],
-                    "duration": str(trip_arrival_date - section_departure_date)
-                })
-
-            itinerary["price"] = price
-            itinerary["price_currency"] = price_currency
-            itinerary["departure_date"] = trip_departure_date.isoformat()
-            itinerary["arrival_date"] = trip_arrival_date.isoformat()
-            itinerary["departure_location"] = trip_departure
-            itinerary["arrival_location"] = trip_arrival
-            itinerary["duration"] = str(trip_arrival_date - trip_departure_date)
-            itinerary["carrier"] = itinerary["legs"][0]["segments"][0]["carrier"]["name"]
-            itinerary["stops"] = len(trip_stops)
-            itinerary["stops_duration"] = str(trip_stops_duration)
-            itinerary["stops_detail"] = trip_stops
-            itinerary["discounts"] = discounts
-
-        return {"date": date, "result": sorted(search_data, key=lambda i: i["price"])}
+                trip_stops.append(Segment(self.parse_location(sections["departure"]),
+                                          self.parse_location(sections["destination"]),
+                                          section_departure_date, trip_arrival_date,
+                                          str(trip_arrival_date - section_departure_date)))
+
+            result.append(Flight(
+                provider=self.NAME,
+                price=price,
+                price_currency=price_currency,
+                departure_date=trip_departure_date,
+                arrival_date=trip_arrival_date,
+                departure_location=trip_stops[0].departure_location,
+                arrival_location=trip_stops[-1].arrival_location,
+                duration=str(trip_arrival_date - trip_departure_date),
+                carrier=itinerary["legs"][0]["segments"][0]["carrier"]["name"],
+                stops=len(trip_stops),
+                stops_duration=str(trip_stops_duration),
+                stops_detail=tuple(trip_stops),
+                discounts=tuple(discounts),
+                raw=itinerary if self.keep_raw else None
+            ))
+
+        return result
 
     def flexible_date(self, destination_geo: int, origin_geo: int, departure_date: str):
-        self.session.headers["Referer"] = self.BASE_URL
-        resp_flexible = self.session.post(self.BASE_URL + self.FLEXIBLE_PATH,
-                                          json={
-                                              "destinationGeoNode": destination_geo, "originGeoNode": origin_geo,
-                                              "departureDate": departure_date,
-                                              "interfaceClient": "ONE_FRONT_SMARTPHONE",
-                                              "tripType": "ONE_WAY", "site": "GB", "numberOfFutureDaysDep": "60"
-                                          })
+        resp_flexible = self.request("POST", self.BASE_URL + self.FLEXIBLE_PATH,
+                                     headers={"Referer": self.BASE_URL},
+                                     json={
+                                         "destinationGeoNode": destination_geo, "originGeoNode": origin_geo,
+                                         "departureDate": departure_date,
+                                         "interfaceClient": "ONE_FRONT_SMARTPHONE",
+                                         "tripType": "ONE_WAY", "site": "GB", "numberOfFutureDaysDep": "60"
+                                     })
 
         if resp_flexible.status_code != 200:
-            raise Exception("invalid response: %s" % resp_flexible)
+            raise ProviderError("invalid response: %s" % resp_flexible)
 
-        return resp_flexible.json()
+        return loads(resp_flexible.content)
+
+    def price_calendar(self, departure: dict, destination: dict, date: str):
+        calendar = {}
+        for entry in self.iter_flexible_prices(self.flexible_date(destination["geoNodeId"], departure["geoNodeId"],
+                                                                  date)):
+            entry_date, price = entry
+            calendar[entry_date] = min(price, calendar.get(entry_date, price))
+
+        return calendar
+
+    @classmethod
+    def iter_flexible_prices(cls, data):
+        # Walk the response looking for {"date"|"departureDate": ..., "price": amount|{"amount": ...}} entries
+        if isinstance(data, list):
+            for item in data:
+                yield from cls.iter_flexible_prices(item)
+
+        elif isinstance(data, dict):
+            date = data.get("departureDate", data.get("date"))
+            price = data.get("price", data.get("minPrice"))
+            if isinstance(price, dict):
+                price = price.get("amount")
+
+            if isinstance(date, str) and isinstance(price, (int, float)):
+                yield date[:10], price
+
+            else:
+                for value in data.values():
+                    yield from cls.iter_flexible_prices(value)
 
     # Autocomplete
-    @staticmethod
-    def autocomplete(search_word: str):
+    def autocomplete(self, search_word: str):
         local_headers = HEADER_DEFAULT.copy()
-        local_headers["Referer"] = eDreams.BASE_URL
+        local_headers["Referer"] = self.BASE_URL
 
-        resp_autocomplete = requests.get(eDreams.BASE_URL + eDreams.AUTOCOMPLETE_PATH.format(search_word),
-                                         headers=local_headers)
+        resp_autocomplete = self.send("GET", self.BASE_URL + self.AUTOCOMPLETE_PATH.format(search_word),
+                                      headers=local_headers)
         if resp_autocomplete.status_code != 200:
-            raise Exception("invalid response: %s" % resp_autocomplete)
+            raise ProviderError("invalid response: %s" % resp_autocomplete)
 
-        return resp_autocomplete.json()
+        return loads(resp_autocomplete.content)
 
     @staticmethod
     def print_autocomplete(suggestion, deep=1):
@@ -0,0 +1,22 @@
+# Fastest JSON decoder available: orjson, msgspec, then the standard library
+try:
+    import orjson
+
+    BACKEND = "orjson"
+    loads = orjson.loads
+
+except ImportError:
+    try:
+        import msgspec.json
+
+        BACKEND = "msgspec"
+        _decoder = msgspec.json.Decoder()
+
+        def loads(data):
+            return _decoder.decode(data.encode() if isinstance(data, str) else data)
+
+    except ImportError:
+        import json
+
+        BACKEND = "json"
+        loads = json.loads
@@ -0,0 +1,62 @@
+import os
+import json
+import threading
+
+from providers import CACHE_DIR
+
+# Bump when the stored location format changes, older indexes are discarded
+LOCATIONS_VERSION = 1
+
+
+class LocationIndex:
+    def __init__(self, provider_name: str, path: str = None):
+        self.provider_name = provider_name
+        self.path = path or os.path.join(CACHE_DIR, "locations-%s.json" % provider_name)
+
+        self.locations = {}
+        self.queries = {}
+
+        self._lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def normalize(search_word: str):
+        return " ".join(search_word.lower().split())
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+
+        except (OSError, ValueError):
+            return
+
+        if data.get("version") != LOCATIONS_VERSION or data.get("provider") != self.provider_name:
+            return
+
+        self.locations = data.get("locations", {})
+        self.queries = data.get("queries", {})
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump({"version": LOCATIONS_VERSION, "provider": self.provider_name,
+                       "locations": self.locations, "queries": self.queries}, f)
+
+        os.replace(tmp_path, self.path)
+
+    def get(self, iata: str):
+        return self.locations.get(iata)
+
+    def query(self, search_word: str):
+        return self.queries.get(self.normalize(search_word))
+
+    def add(self, search_word: str, suggestions: list, locations):
+        with self._lock:
+            self.queries[self.normalize(search_word)] = suggestions
+            for iata, location in locations:
+                self.locations.setdefault(iata, location)
+
+            self.save()
@@ -0,0 +1,135 @@
+import sys
+import json
+import time
+import cProfile
+import logging
+import threading
+import contextlib
+import collections
+
+logger = logging.getLogger("flyscanner.metrics")
+
+
+class Metrics:
+    FIELDS = ("count", "seconds", "bytes", "retries", "errors", "server_seconds")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans = collections.defaultdict(lambda: dict.fromkeys(self.FIELDS, 0))
+
+    @contextlib.contextmanager
+    def span(self, name: str, provider: str = ""):
+        # The caller can fill `bytes`, `retries` and `server_seconds` while the span is open
+        info = {"bytes": 0, "retries": 0, "server_seconds": 0.0}
+        error = None
+        start = time.perf_counter()
+        try:
+            yield info
+
+        except BaseException as e:
+            error = e
+            raise
+
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                totals = self.spans[(name, provider)]
+                totals["count"] += 1
+                totals["seconds"] += elapsed
+                totals["bytes"] += info["bytes"]
+                totals["retries"] += info["retries"]
+                totals["server_seconds"] += info["server_seconds"]
+                totals["errors"] += error is not None
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(json.dumps({
+                    "ts": time.time(), "span": name, "provider": provider, "seconds": round(elapsed, 6),
+                    "bytes": info["bytes"], "retries": info["retries"],
+                    "server_seconds": round(info["server_seconds"], 6),
+                    "error": repr(error) if error is not None else None,
+                    "thread": threading.current_thread().name
+                }))
+
+    def prometheus(self):
+        with self._lock:
+            spans = {key: dict(totals) for key, totals in self.spans.items()}
+
+        lines = []
+        for field in self.FIELDS:
+            metric = "flyscanner_span_%s_total" % field
+            lines.append("# TYPE %s counter" % metric)
+            for (name, provider), totals in sorted(spans.items()):
+                lines.append('%s{span="%s",provider="%s"} %s' % (metric, name, provider, totals[field]))
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        with open(path, "w") as f:
+            f.write(self.prometheus())
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+
+
+METRICS = Metrics()
+
+
+def span(name: str, provider: str = ""):
+    return METRICS.span(name, provider)
+
+
+class ThreadProfiler:
+    # Up to 3.11 cProfile only follows the thread that enabled it: start one profile per thread and merge them
+    # at the end. From 3.12 it runs on sys.monitoring, which sees every thread but allows one profiler at a time
+    PER_THREAD = sys.version_info < (3, 12)
+
+    def __init__(self):
+        self.profiles = []
+        self._lock = threading.Lock()
+
+    def _new_profile(self):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+
+        except ValueError:
+            # Another profiler is already active
+            return False
+
+        with self._lock:
+            self.profiles.append(profile)
+
+        return True
+
+    def _thread_hook(self, frame, event, arg):
+        sys.setprofile(None)
+        self._new_profile()
+
+    def start(self):
+        if not self._new_profile():
+            raise RuntimeError("another profiling tool is already active")
+
+        if self.PER_THREAD:
+            threading.setprofile(self._thread_hook)
+
+    def stop(self, path: str, stream=None):
+        import pstats
+
+        threading.setprofile(None)
+        with self._lock:
+            profiles = list(self.profiles)
+
+        stats = pstats.Stats(stream=stream)
+        for profile in profiles:
+            profile.disable()
+
+            # Threads that never ran Python code leave an empty profile, which Stats refuses
+            try:
+                stats.add(pstats.Stats(profile))
+
+            except TypeError:
+                pass
+
+        stats.dump_stats(path)
+        return stats
@@ -0,0 +1,95 @@
+import datetime
+from dataclasses import dataclass, field
+
+
+@dataclass(slots=True)
+class Segment:
+    departure_location: str
+    arrival_location: str
+    departure_date: datetime.datetime
+    arrival_date: datetime.datetime
+    duration: str
+
+    def to_dict(self):
+        return {
+            "departure_location": self.departure_location,
+            "arrival_location": self.arrival_location,
+            "departure_date": self.departure_date.isoformat(),
+            "arrival_date": self.arrival_date.isoformat(),
+            "duration": self.duration
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(data["departure_location"], data["arrival_location"],
+                   datetime.datetime.fromisoformat(data["departure_date"]),
+                   datetime.datetime.fromisoformat(data["arrival_date"]),
+                   data["duration"])
+
+
+@dataclass(slots=True)
+class Discount:
+    price: float
+    price_currency: str
+    reason: str
+
+    def to_dict(self):
+        return {"price": self.price, "price_currency": self.price_currency, "reason": self.reason}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(data["price"], data["price_currency"], data["reason"])
+
+
+@dataclass(slots=True)
+class Flight:
+    provider: str
+    price: float
+    price_currency: str
+    departure_date: datetime.datetime
+    arrival_date: datetime.datetime
+    departure_location: str
+    arrival_location: str
+    duration: str
+    carrier: str
+    stops: int
+    stops_duration: str
+    stops_detail: tuple = ()
+    discounts: tuple = ()
+
+    # Provider payload, only kept when asked (Provider(keep_raw=True))
+    raw: dict = field(default=None, repr=False, compare=False)
+
+    def to_dict(self, raw: bool = False):
+        data = {
+            "provider": self.provider,
+            "price": self.price,
+            "price_currency": self.price_currency,
+            "departure_date": self.departure_date.isoformat(),
+            "arrival_date": self.arrival_date.isoformat(),
+            "departure_location": self.departure_location,
+            "arrival_location": self.arrival_location,
+            "duration": self.duration,
+            "carrier": self.carrier,
+            "stops": self.stops,
+            "stops_duration": self.stops_duration,
+            "stops_detail": [x.to_dict() for x in self.stops_detail],
+            "discounts": [x.to_dict() for x in self.discounts]
+        }
+
+        if raw and self.raw is not None:
+            data["raw"] = self.raw
+
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(data["provider"], data["price"], data["price_currency"],
+                   datetime.datetime.fromisoformat(data["departure_date"]),
+                   datetime.datetime.fromisoformat(data["arrival_date"]),
+                   data["departure_location"], data["arrival_location"], data["duration"], data["carrier"],
+                   data["stops"], data["stops_duration"],
+                   tuple(Segment.from_dict(x) for x in data["stops_detail"]),
+                   tuple(Discount.from_dict(x) for x in data["discounts"]),
+                   data.get("raw"))
+
@@ -1,11 +1,13 @@
-import time
 import datetime
-import requests
 
-from providers import HEADER_DEFAULT
+from providers import HEADER_DEFAULT, ProviderError, ProviderBlocked
+from providers.base import Provider
+from providers.models import Flight, Segment
+from providers.metrics import span
+from providers.jsonlib import loads
 
 
-class Ryanair:
+class Ryanair(Provider):
     NAME = "Ryanair"
 
     # Static
@@ -20,65 +22,82 @@ class Ryanair:
 
     AUTOCOMPLETE_PATH = "/api/locate/v1/autocomplete/airports?phrase={0}&market=it-it"
 
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers = HEADER_DEFAULT.copy()
+    # Limits
+    MAX_CONCURRENCY = 2
+    RATE = 2.0
 
-        # Debug
-        # self.session.proxies = {"http": "http://127.0.0.1:8080", "https": "https://127.0.0.1:8080"}
-        # self.session.verify = False
-
-        self.__init_cookies()
-
-    def __init_cookies(self):
+    def _init_cookies(self):
         self.session.cookies.clear()
 
-        resp_home = self.session.get(self.BASE_URL + self.HOME_PATH)
+        resp_home = self.send("GET", self.BASE_URL + self.HOME_PATH)
         if resp_home.status_code != 200:
-            raise Exception("invalid response: %s" % resp_home)
+            raise ProviderError("invalid response: %s" % resp_home)
 
         self.session.headers["Referer"] = self.BASE_URL + self.HOME_PATH
 
+    def is_blocked(self, resp):
+        # Ryanair answers with a generic 404 when the IP is throttled
+        return super().is_blocked(resp) or \
+            (resp.status_code == 404 and "No HTTP resource was found" in resp.text)
+
     # Location
     def prepare_location(self, location: dict):
         if "iata" not in location or not location["iata"]:
             return False
 
-        for autocomplete in self.autocomplete(location["iata"]):
-            if autocomplete["code"] == location["iata"]:
-                autocomplete["iata"] = autocomplete["code"]
-                return autocomplete
+        return self.resolve_location(location["iata"]) or False
 
-            return False
+    def nearby_locations(self, location: dict):
+        # Airports sharing the city code (e.g. ROM: FCO and CIA)
+        city = location.get("city") or {}
+        if not city.get("macCode"):
+            return [location]
+
+        nearby = {found_iata: found_location for found_iata, found_location in self.iter_locations(
+            self.lookup(city["name"])) if (found_location.get("city") or {}).get("macCode") == city["macCode"]}
+        nearby.setdefault(location["iata"], location)
+        return list(nearby.values())
 
-        return False
+    @classmethod
+    def iter_locations(cls, suggestions: list):
+        for suggestion in suggestions:
+            suggestion["iata"] = suggestion["code"]
+            yield suggestion["iata"], suggestion
 
     # Search
     def search(self, num_adults: int, date: str, departure: dict, destination: dict):
-        time.sleep(1)
-
-        resp_search = self.session.get(self.BASE_URL + self.SEARCH_PATH.format(
+        resp_search = self.request("GET", self.BASE_URL + self.SEARCH_PATH.format(
             adults=num_adults,
             date=date,
             departure_iata=departure["iata"],
             destination_iata=destination["iata"]
         ))
 
-        if resp_search.status_code == 404 and "No HTTP resource was found" in resp_search.text:
-            print("[!] No flight info or IP Blocked")
-            return {"date": date, "result": []}
+        # The generic 404 is a block too: the date is searched again later, nothing is cached. The message
+        # reaches the renderer (stderr for ndjson/tsv) through FlyScanner.merge_results
+        if self.is_blocked(resp_search):
+            raise ProviderBlocked("%s: %s" % ("no flight info or IP blocked" if resp_search.status_code == 404
+                                              else "blocked", resp_search))
 
         elif resp_search.status_code != 200:
-            raise Exception("invalid response: %s" % resp_search)
+            raise ProviderError("invalid response: %s" % resp_search)
+
+        with span("decode", self.NAME):
+            resp_data = loads(resp_search.content)
 
-        resp_data = resp_search.json()
+        with span("parse", self.NAME):
+            result = self.parse_availability(resp_data)
 
+        return {"date": date, "result": sorted(result, key=lambda i: i.price)}
+
+    def parse_availability(self, resp_data: dict):
         price_currency = resp_data.get("currency", "N/D")
         departure_location = resp_data["trips"][0]["originName"] + " - " + resp_data["trips"][0]["origin"]
         arrival_location = resp_data["trips"][0]["destinationName"] + " - " + resp_data["trips"][0]["destination"]
 
         search_data = resp_data["trips"][0]["dates"][0]["flights"]
 
+        result = []
         for flight in search_data:
             if flight["faresLeft"] == 0:
                 continue
@@ -96,41 +115,35 @@ class Ryanair:
 
                 last_arrival_time = datetime.datetime.fromisoformat(segment["time"][1])
 
-                trip_stops.append({
-                    "departure_location": segment["origin"],
-                    "arrival_location": segment["destination"],
-                    "departure_date": segment["time"][0],
-                    "arrival_date": segment["time"][1],
-                    "duration": segment["duration"]
-                })
-
-            flight["price"] = price
-            flight["price_currency"] = price_currency
-            flight["departure_date"] = flight["time"][0]
-            flight["arrival_date"] = flight["time"][1]
-            flight["departure_location"] = departure_location
-            flight["arrival_location"] = arrival_location
-            # flight["duration"]
-            flight["carrier"] = flight["operatedBy"]
-            flight["stops"] = len(trip_stops)
-            flight["stops_duration"] = str(trip_stops_duration)
-            flight["stops_detail"] = trip_stops
-            flight["discounts"] = []
-
-        return {"date": date, "result": sorted(
-            filter(lambda x: x["faresLeft"] != 0, search_data),
-            key=lambda i: i["price"]
-        )}
+                trip_stops.append(Segment(segment["origin"], segment["destination"],
+                                          segment_departure_time, last_arrival_time, segment["duration"]))
+
+            result.append(Flight(
+                provider=self.NAME,
+                price=price,
+                price_currency=price_currency,
+                departure_date=datetime.datetime.fromisoformat(flight["time"][0]),
+                arrival_date=datetime.datetime.fromisoformat(flight["time"][1]),
+                departure_location=departure_location,
+                arrival_location=arrival_location,
+                duration=flight["duration"],
+                carrier=flight["operatedBy"],
+                stops=len(trip_stops),
+                stops_duration=str(trip_stops_duration),
+                stops_detail=tuple(trip_stops),
+                raw=flight if self.keep_raw else None
+            ))
+
+        return result
 
     # Autocomplete
-    @staticmethod
-    def autocomplete(search_word: str):
-        resp_autocomplete = requests.get(Ryanair.BASE_URL + Ryanair.AUTOCOMPLETE_PATH.format(search_word),
-                                         headers=HEADER_DEFAULT.copy())
+    def autocomplete(self, search_word: str):
+        resp_autocomplete = self.send("GET", self.BASE_URL + self.AUTOCOMPLETE_PATH.format(search_word),
+                                      headers=HEADER_DEFAULT.copy())
         if resp_autocomplete.status_code != 200:
-            raise Exception("invalid response: %s" % resp_autocomplete)
+            raise ProviderError("invalid response: %s" % resp_autocomplete)
 
-        return resp_autocomplete.json()
+        return loads(resp_autocomplete.content)
 
     @staticmethod
     def print_autocomplete(suggestion, deep=1):
@@ -0,0 +1,90 @@
+import time
+import threading
+
+from providers import SearchCancelled
+
+
+class Throttle:
+    # How often a waiting caller checks the cancel event
+    CANCEL_POLL = 0.5
+
+    def __init__(self, max_concurrency: int = 1, rate: float = None, min_rate: float = 0.1, max_rate: float = None,
+                 cancelled: threading.Event = None):
+        self.max_concurrency = max_concurrency
+        self.cancelled = cancelled
+
+        # Token bucket, `rate` adapts to the provider answers (None = unlimited)
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate or (rate * 2 if rate else None)
+        self.rate_step = rate / 20 if rate else None
+
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._tokens = float(max_concurrency)
+        self._updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(float(self.max_concurrency), self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def wait(self, seconds: float):
+        # Sleep, unless the search is cancelled meanwhile
+        if self.cancelled is None:
+            time.sleep(seconds)
+
+        elif self.cancelled.wait(seconds):
+            raise SearchCancelled("cancelled")
+
+    def check_cancelled(self):
+        if self.cancelled is not None and self.cancelled.is_set():
+            raise SearchCancelled("cancelled")
+
+    def acquire(self):
+        self.check_cancelled()
+        while not self._semaphore.acquire(timeout=self.CANCEL_POLL):
+            self.check_cancelled()
+
+        try:
+            while self.rate:
+                with self._lock:
+                    self._refill()
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        break
+
+                    wait = (1 - self._tokens) / self.rate
+
+                self.wait(wait)
+
+        except SearchCancelled:
+            self._semaphore.release()
+            raise
+
+    def release(self):
+        self._semaphore.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    # Additive increase on success, multiplicative decrease when the provider pushes back
+    def on_success(self):
+        if not self.rate:
+            return
+
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.rate_step)
+
+    def on_throttled(self):
+        if not self.rate:
+            return
+
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0.0)
@@ -0,0 +1,217 @@
+import sys
+import json
+import queue
+import threading
+
+import providers
+
+
+class Renderer:
+    # Results are formatted and written by a consumer thread, in batches, so a slow terminal or pipe
+    # never blocks the search
+    STATUS_TO_STDERR = True
+
+    def __init__(self, show_all: bool = False, detail: bool = True, show_provider: bool = False,
+                 stream=None, batch_size: int = 256):
+        self.show_all = show_all
+        self.detail = detail
+        self.show_provider = show_provider
+        self.stream = stream
+        self.batch_size = batch_size
+
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(name="FlyRenderer", target=self.run, daemon=True)
+        self.thread.start()
+
+    def solutions(self, search_resp: dict):
+        return search_resp["result"] if self.show_all else search_resp["result"][:1]
+
+    def format(self, search_resp: dict, **extra):
+        raise NotImplementedError
+
+    def format_pairs(self, pairs: list):
+        raise NotImplementedError
+
+    def render(self, search_resp: dict, **extra):
+        self.queue.put((self.format, (search_resp,), extra))
+
+    def render_pairs(self, pairs: list):
+        self.queue.put((self.format_pairs, (pairs,), {}))
+
+    def message(self, text: str):
+        # Machine formats keep stdout for the results only
+        if self.STATUS_TO_STDERR:
+            print(text, file=sys.stderr)
+
+        else:
+            self.queue.put(text + "\n")
+
+    def run(self):
+        while True:
+            items = [self.queue.get()]
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self.queue.get_nowait())
+
+                except queue.Empty:
+                    break
+
+            chunks = []
+            closed = False
+            for item in items:
+                if item is None:
+                    closed = True
+
+                elif isinstance(item, str):
+                    chunks.append(item)
+
+                else:
+                    # One bad result is reported and skipped: the thread must live on to mark every item done
+                    formatter, args, kwargs = item
+                    try:
+                        chunks.append(formatter(*args, **kwargs))
+
+                    except Exception as e:
+                        print("[!] Render failed: %r" % e, file=sys.stderr)
+
+            try:
+                stream = self.stream or sys.stdout
+                stream.write("".join(chunks))
+                stream.flush()
+
+            except (BrokenPipeError, ValueError):
+                pass
+
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+
+            if closed:
+                return
+
+    def flush(self):
+        self.queue.join()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+
+class PrettyRenderer(Renderer):
+    STATUS_TO_STDERR = False
+
+    def format(self, search_resp: dict, **extra):
+        lines = []
+        for solution in self.solutions(search_resp):
+            lines.append("  • ✈️  FOUND: %s %s - %s - 🕓 %s ✈️ %s" % (
+                solution.price, solution.price_currency, solution.carrier, solution.duration,
+                " (%s)" % solution.provider if self.show_provider else ""))
+
+            if not self.detail:
+                break
+
+            lines.append("  Departure: " + solution.departure_date.isoformat())
+            lines.append("  From: " + solution.departure_location)
+            lines.append("  Arrival: " + solution.arrival_date.isoformat())
+            lines.append("  To: " + solution.arrival_location)
+
+            if solution.stops > 1:
+                lines.append("  Stops: %d - No Fly Duration: %s" % (solution.stops - 1, solution.stops_duration))
+
+                for stop, segment in enumerate(solution.stops_detail):
+                    lines.append("   • ✈️  STOP %d  ✈️ " % (stop + 1))
+                    lines.append("   Departure: " + segment.departure_date.isoformat())
+                    lines.append("   From: " + segment.departure_location)
+                    lines.append("   Arrival: " + segment.arrival_date.isoformat())
+                    lines.append("   To: " + segment.arrival_location)
+                    lines.append("   Duration: " + segment.duration)
+
+            if len(solution.discounts) > 0:
+                lines.append("  Available Discounts:")
+                for discount in solution.discounts:
+                    lines.append("   Discount: %s %s %s" % (discount.price, discount.price_currency, discount.reason))
+
+            lines.append("")
+
+        return "".join(line + "\n" for line in lines)
+
+    def format_pairs(self, pairs: list):
+        lines = []
+        for rank, pair in enumerate(pairs):
+            lines.append("  %d. 💰 TOTAL: %.2f %s - %d nights" % (rank + 1, pair.price, pair.price_currency,
+                                                                 pair.stay))
+            for leg, flight in (("Outbound", pair.outbound), ("Return", pair.inbound)):
+                lines.append("   %-8s %s %s - %s - %s -> %s - %s → %s%s" % (
+                    leg, flight.price, flight.price_currency, flight.carrier,
+                    flight.departure_date.strftime("%Y-%m-%d %H:%M"), flight.arrival_date.strftime("%H:%M"),
+                    flight.departure_location, flight.arrival_location,
+                    " (%s)" % flight.provider if self.show_provider else ""))
+
+            lines.append("")
+
+        return "".join(line + "\n" for line in lines)
+
+
+class NdjsonRenderer(Renderer):
+    def format(self, search_resp: dict, **extra):
+        return "".join(json.dumps(dict(extra, **solution.to_dict()), default=str) + "\n"
+                       for solution in self.solutions(search_resp))
+
+    def format_pairs(self, pairs: list):
+        return "".join(json.dumps(pair.to_dict(), default=str) + "\n" for pair in pairs)
+
+
+class TsvRenderer(Renderer):
+    def __init__(self, *args, **kwargs):
+        self.columns = None
+        super().__init__(*args, **kwargs)
+
+    @staticmethod
+    def cell(value):
+        if isinstance(value, (list, tuple)):
+            value = " | ".join(" ".join(str(x) for x in item.values()) if isinstance(item, dict) else str(item)
+                               for item in value)
+
+        return "" if value is None else str(value).replace("\t", " ").replace("\n", " ")
+
+    def format(self, search_resp: dict, **extra):
+        rows = []
+        for solution in self.solutions(search_resp):
+            data = dict(extra, **solution.to_dict())
+
+            # The header is written once, with the columns of the first row
+            if self.columns is None:
+                self.columns = list(extra) + providers.FLIGHT_DEFAULT
+                rows.append("\t".join(self.columns))
+
+            rows.append("\t".join(self.cell(data.get(column)) for column in self.columns))
+
+        return "".join(row + "\n" for row in rows)
+
+    def format_pairs(self, pairs: list):
+        legs = ("provider", "price", "departure_date", "arrival_date", "departure_location", "arrival_location",
+                "carrier", "stops")
+        rows = ["\t".join(["price", "price_currency", "stay"] + ["outbound_" + x for x in legs] +
+                          ["inbound_" + x for x in legs])]
+        for pair in pairs:
+            outbound = pair.outbound.to_dict()
+            inbound = pair.inbound.to_dict()
+            rows.append("\t".join(self.cell(x) for x in [round(pair.price, 2), pair.price_currency, pair.stay] +
+                                  [outbound[x] for x in legs] + [inbound[x] for x in legs]))
+
+        return "".join(row + "\n" for row in rows)
+
+
+RENDERERS = {
+    "pretty": PrettyRenderer,
+    "ndjson": NdjsonRenderer,
+    "tsv": TsvRenderer
+}
+
+
+def open_renderer(output_format: str = "pretty", **kwargs):
+    if output_format not in RENDERERS:
+        raise ValueError("unsupported format %s (%s)" % (output_format, ", ".join(RENDERERS)))
+
+    return RENDERERS[output_format](**kwargs)
@@ -0,0 +1,191 @@
+import json
+import datetime
+import threading
+import http.server
+import urllib.parse
+import concurrent.futures
+
+import providers
+from providers.metrics import METRICS
+
+
+class Coalescer:
+    # Identical searches submitted while one is in flight share its future, whichever client asked first
+    def __init__(self, executor):
+        self.executor = executor
+        self.in_flight = {}
+        self.coalesced = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fetch, provider, adults: int, date: str, departure: dict, destination: dict,
+               max_age: float = None):
+        key = provider.NAME, adults, date, provider.query_key(departure), provider.query_key(destination)
+        with self._lock:
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future
+
+            future = self.in_flight[key] = self.executor.submit(fetch, provider, adults, date, departure, destination,
+                                                                   max_age)
+
+        future.add_done_callback(lambda _: self.forget(key, future))
+        return future
+
+    def forget(self, key: tuple, future):
+        with self._lock:
+            if self.in_flight.get(key) is future:
+                del self.in_flight[key]
+
+
+class SearchHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+
+        route = {
+            "/search": self.search,
+            "/locations": self.locations,
+            "/providers": self.providers,
+            "/metrics": self.metrics,
+            "/health": self.health
+        }.get(url.path)
+
+        if route is None:
+            return self.reply(404, {"error": "unknown path %s" % url.path})
+
+        try:
+            route(query)
+
+        except ValueError as e:
+            self.reply(400, {"error": str(e)})
+
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def reply(self, status: int, data, content_type: str = "application/json"):
+        body = data.encode() if isinstance(data, str) else json.dumps(data, default=str).encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Routes
+    def health(self, query: dict):
+        self.reply(200, {"status": "ok", "in_flight": len(self.server.coalescer.in_flight),
+                         "coalesced": self.server.coalescer.coalesced})
+
+    def providers(self, query: dict):
+        self.reply(200, [provider.NAME for provider in self.server.fly.providers])
+
+    def metrics(self, query: dict):
+        self.reply(200, METRICS.prometheus(), "text/plain; version=0.0.4")
+
+    def locations(self, query: dict):
+        if not query.get("q"):
+            raise ValueError("q required")
+
+        self.reply(200, {provider.NAME: provider.lookup(query["q"])
+                         for provider in self.server.select_providers(query.get("provider"))})
+
+    def search(self, query: dict):
+        for name in ("from", "to", "date"):
+            if not query.get(name):
+                raise ValueError("%s required" % name)
+
+        search_providers = self.server.select_providers(query.get("provider"))
+        departure = self.server.location(query["from"])
+        destination = self.server.location(query["to"])
+        if not departure or not destination:
+            raise ValueError("invalid IATA")
+
+        dates = list(self.server.fly.iter_dates(query["date"], query.get("to_date") or query["date"]))
+        if len(dates) > self.server.MAX_DATES:
+            raise ValueError("at most %d dates per search" % self.server.MAX_DATES)
+
+        adults = int(query.get("adults", 1))
+        show_all = query.get("all") in ("1", "true")
+
+        # Every date is submitted at once, the answers are streamed back in date order, one NDJSON line per date
+        fly = self.server.fly
+        pending = [(date, fly.submit_search(self.server.coalescer, adults, date, departure, destination,
+                                            search_providers)) for date in dates]
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        for date, futures in pending:
+            search_resp, failed = fly.merge_results(date, futures)
+            if fly.history:
+                fly.history.record(search_resp, "%s-%s" % (query["from"].upper(), query["to"].upper()))
+
+            self.write_chunk(json.dumps({
+                "date": date,
+                "result": [x.to_dict() for x in (search_resp["result"] if show_all else search_resp["result"][:1])],
+                "failed": [provider.NAME for provider in failed]
+            }, default=str) + "\n")
+
+        self.write_chunk("")
+
+    def write_chunk(self, data: str):
+        body = data.encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(body), body))
+        self.wfile.flush()
+
+    def log_message(self, fmt, *args):
+        print("[%s] %s" % (datetime.datetime.now().strftime("%H:%M:%S"), fmt % args))
+
+
+class SearchServer(http.server.ThreadingHTTPServer):
+    # Providers (sessions, throttles, location indexes) and the cache stay warm between requests
+    daemon_threads = True
+    request_queue_size = 128
+
+    MAX_DATES = 92
+
+    def __init__(self, fly, host: str = "127.0.0.1", port: int = 8080):
+        super().__init__((host, port), SearchHandler)
+
+        self.fly = fly
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=fly.workers * sum(provider.MAX_CONCURRENCY for provider in fly.providers),
+            thread_name_prefix="FlyServer")
+        self.coalescer = Coalescer(self.executor)
+
+        self._locations = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://%s:%d" % self.server_address[:2]
+
+    def select_providers(self, names: str = None):
+        if not names:
+            return self.fly.providers
+
+        selected = providers.parse_providers(names)
+        return [provider for provider in self.fly.providers if provider.NAME in selected]
+
+    def location(self, iata: str):
+        iata = iata.upper()
+        with self._lock:
+            if iata in self._locations:
+                return self._locations[iata]
+
+        location = self.fly.prepare_location(iata)
+        with self._lock:
+            self._locations[iata] = location
+
+        return location
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.fly.stop_search()
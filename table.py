@@ -0,0 +1,161 @@
+import re
+
+SORT_KEYS = ("price", "duration", "stops", "layover", "departure")
+
+
+def parse_duration(value: str):
+    # "5" or "5h" hours, "90m" minutes, "2:30" hours and minutes: minutes
+    match = re.fullmatch(r"\s*(?:(\d+(?:\.\d+)?)\s*h?|(\d+)\s*m|(\d+):(\d{2}))\s*", value, re.IGNORECASE)
+    if not match:
+        raise ValueError("invalid duration %s (use 5h, 90m or 2:30)" % value)
+
+    hours, minutes, clock_hours, clock_minutes = match.groups()
+    if hours is not None:
+        return float(hours) * 60
+
+    if minutes is not None:
+        return float(minutes)
+
+    return int(clock_hours) * 60 + int(clock_minutes)
+
+
+def parse_clock(value: str):
+    # Provider durations: "02:35" (Ryanair), "2:35:00" or "1 day, 2:35:00" (eDreams): minutes
+    match = re.fullmatch(r"\s*(?:(\d+) days?,\s*)?(\d+):(\d{2})(?::(\d{2}(?:\.\d+)?))?\s*", value or "")
+    if not match:
+        raise ValueError("invalid duration %s" % value)
+
+    days, hours, minutes, seconds = match.groups()
+    return int(days or 0) * 24 * 60 + int(hours) * 60 + int(minutes) + float(seconds or 0) / 60
+
+
+def parse_time_window(value: str):
+    # "06:00-12:30": minutes of the day, the window can wrap around midnight ("22:00-06:00")
+    match = re.fullmatch(r"\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*", value)
+    if not match:
+        raise ValueError("invalid time window %s (use HH:MM-HH:MM)" % value)
+
+    start_hour, start_minute, end_hour, end_minute = (int(x) for x in match.groups())
+    if max(start_hour, end_hour) > 23 or max(start_minute, end_minute) > 59:
+        raise ValueError("invalid time window %s (use HH:MM-HH:MM)" % value)
+
+    return start_hour * 60 + start_minute, end_hour * 60 + end_minute
+
+
+def parse_sort(value: str):
+    keys = [x.strip() for x in value.split(",") if x.strip()]
+    for key in keys:
+        if key.lstrip("-") not in SORT_KEYS:
+            raise ValueError("invalid sort key %s (choose from %s, prefix - to reverse)" % (key, ", ".join(SORT_KEYS)))
+
+    return keys
+
+
+class ResultTable:
+    # Columnar view of many flights (any date, any provider): filters and sorts run on whole NumPy columns
+
+    def __init__(self, flights: list, columns: dict = None):
+        import numpy
+
+        self.numpy = numpy
+        self.flights = list(flights)
+        self.columns = columns if columns is not None else self.build_columns(self.flights)
+
+    def build_columns(self, flights: list):
+        numpy = self.numpy
+
+        # Ryanair dates are naive local times: only the durations given by the provider are comparable
+        # across time zones, the dates are a fallback for unknown formats
+        def duration(flight):
+            try:
+                return parse_clock(flight.duration)
+
+            except ValueError:
+                return (flight.arrival_date - flight.departure_date).total_seconds() / 60
+
+        def gaps(flight):
+            try:
+                return parse_clock(flight.stops_duration)
+
+            except ValueError:
+                segments = flight.stops_detail
+                return sum((segments[i + 1].departure_date - segments[i].arrival_date).total_seconds()
+                           for i in range(len(segments) - 1)) / 60
+
+        return {
+            "price": numpy.fromiter((x.price for x in flights), float, len(flights)),
+            "stops": numpy.fromiter((max(0, x.stops - 1) for x in flights), int, len(flights)),
+            "duration": numpy.fromiter((duration(x) for x in flights), float, len(flights)),
+            "layover": numpy.fromiter((gaps(x) for x in flights), float, len(flights)),
+            "departure": numpy.fromiter((x.departure_date.hour * 60 + x.departure_date.minute for x in flights),
+                                        int, len(flights)),
+            "carrier": numpy.array([(x.carrier or "").lower() for x in flights], dtype=object),
+            "provider": numpy.array([x.provider for x in flights], dtype=object)
+        }
+
+    def __len__(self):
+        return len(self.flights)
+
+    def __iter__(self):
+        return iter(self.flights)
+
+    def __getitem__(self, column: str):
+        return self.columns[column]
+
+    def take(self, indexes):
+        return ResultTable([self.flights[i] for i in indexes.tolist()],
+                           {name: column[indexes] for name, column in self.columns.items()})
+
+    def where(self, mask):
+        return self.take(self.numpy.flatnonzero(mask))
+
+    def select(self, max_stops: int = None, depart_between: tuple = None, max_duration: float = None,
+               max_layover: float = None, carriers: list = None, max_price: float = None):
+        mask = self.numpy.ones(len(self), dtype=bool)
+
+        if max_stops is not None:
+            mask &= self["stops"] <= max_stops
+
+        if depart_between is not None:
+            start, end = depart_between
+            departure = self["departure"]
+            mask &= ((departure >= start) & (departure <= end)) if start <= end else \
+                ((departure >= start) | (departure <= end))
+
+        if max_duration is not None:
+            mask &= self["duration"] <= max_duration
+
+        if max_layover is not None:
+            mask &= self["layover"] <= max_layover
+
+        if carriers:
+            mask &= self.numpy.isin(self["carrier"], [x.lower() for x in carriers])
+
+        if max_price is not None:
+            mask &= self["price"] <= max_price
+
+        return self.where(mask)
+
+    def sort(self, *keys: str):
+        # "price", "-duration": the first key counts most, ties keep the current order
+        if not keys or not len(self):
+            return self
+
+        return self.take(self.numpy.lexsort([-self[key[1:]] if key.startswith("-") else self[key]
+                                             for key in reversed(keys)]))
+
+
+class Ranking:
+    # The filters and the order applied to every result list before it is shown or saved
+    def __init__(self, sort: list = None, **filters):
+        self.sort_keys = list(sort or [])
+        self.filters = {name: value for name, value in filters.items() if value is not None}
+
+    def __bool__(self):
+        return bool(self.sort_keys or self.filters)
+
+    def apply(self, flights: list):
+        if not flights:
+            return flights
+
+        return ResultTable(flights).select(**self.filters).sort(*self.sort_keys).flights
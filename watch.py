@@ -0,0 +1,128 @@
+import json
+import time
+import heapq
+import datetime
+import threading
+import urllib.request
+import concurrent.futures
+
+
+# Sinks
+class StdoutSink:
+    def emit(self, event: dict):
+        print("  • %s %s %s: %s%s %s - %s %s (%s)%s" % (
+            "🔔" if event["type"] == "alert" else "🆕" if event["old_price"] is None else
+            "📈" if event["old_price"] < event["price"] else "📉",
+            event["route"], event["date"],
+            "%s -> " % event["old_price"] if event["old_price"] is not None else "NEW ",
+            event["price"], event["currency"], event["carrier"], event["departure_date"], event["provider"],
+            " - " + event["reason"] if event.get("reason") else ""))
+
+
+class FileSink:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def emit(self, event: dict):
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(event) + "\n")
+
+
+class WebhookSink:
+    def __init__(self, url: str, timeout: float = 5):
+        self.url = url
+        self.timeout = timeout
+
+    def emit(self, event: dict):
+        request = urllib.request.Request(self.url, data=json.dumps(event).encode(), method="POST",
+                                         headers={"Content-Type": "application/json"})
+        try:
+            urllib.request.urlopen(request, timeout=self.timeout).close()
+
+        except OSError as e:
+            print("[!] Webhook failed: %s" % e)
+
+
+class Watcher:
+    def __init__(self, fly, history, interval: float = 900, alert_below: float = None, alert_drop: float = None,
+                 sinks: list = None, alerts_only: bool = False):
+        self.fly = fly
+        self.history = history
+
+        self.interval = interval
+        self.alert_below = alert_below
+        self.alert_drop = alert_drop
+        self.sinks = sinks or [StdoutSink()]
+        self.alerts_only = alerts_only
+
+        self._stop = threading.Event()
+
+    # Schedule
+    def poll_interval(self, unit: dict):
+        # Close departures and volatile prices are polled more often
+        days = (datetime.date.fromisoformat(unit["date"]) - datetime.date.today()).days
+        interval = self.interval * (0.25 if days <= 3 else 0.5 if days <= 14 else 1 if days <= 60 else 2)
+
+        changes = self.history.changes_since(unit["route"], unit["date"], time.time() - 24 * 60 * 60)
+        interval = interval / (1 + min(changes, 20) / 4)
+
+        return max(self.interval / 8, min(self.interval * 8, interval))
+
+    def events(self, unit: dict, changes: list):
+        for flight, old_price in changes:
+            event = {
+                "type": "change", "route": unit["route"], "date": unit["date"], "provider": flight.provider,
+                "carrier": flight.carrier, "departure_date": flight.departure_date.isoformat(),
+                "old_price": old_price, "price": flight.price, "currency": flight.price_currency,
+                "observed_at": datetime.datetime.now().isoformat(timespec="seconds")
+            }
+
+            if self.alert_below is not None and flight.price <= self.alert_below and \
+                    (old_price is None or old_price > self.alert_below):
+                event.update(type="alert", reason="below %s" % self.alert_below)
+
+            elif self.alert_drop and old_price and (old_price - flight.price) / old_price * 100 >= self.alert_drop:
+                event.update(type="alert", reason="dropped %.1f%%" % ((old_price - flight.price) / old_price * 100))
+
+            if event["type"] == "alert" or not self.alerts_only:
+                yield event
+
+    def run(self, units: list):
+        schedule = [(0.0, i) for i in range(len(units))]
+        heapq.heapify(schedule)
+
+        print("Watching: %d searches, every %d seconds (adaptive)" % (len(units), self.interval))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.fly.workers * len(self.fly.providers),
+                                                   thread_name_prefix="FlyWatcher") as executor:
+            while schedule and not self._stop.is_set():
+                due_at = schedule[0][0]
+                if self._stop.wait(max(0.0, due_at - time.time())):
+                    break
+
+                # Everything due now is fetched together
+                due = []
+                while schedule and schedule[0][0] <= time.time() and len(due) < self.fly.workers:
+                    due.append(heapq.heappop(schedule)[1])
+
+                # A cached result older than the poll interval would hide the price changes it polls for
+                in_flight = [(i, self.fly.submit_search(executor, units[i]["adults"], units[i]["date"],
+                                                        units[i]["departure"], units[i]["destination"],
+                                                        units[i].get("providers"), self.poll_interval(units[i])))
+                             for i in due]
+
+                for i, futures in in_flight:
+                    unit = units[i]
+                    search_resp, _ = self.fly.merge_results(unit["date"], futures)
+
+                    # Unchanged prices produce no event
+                    for event in self.events(unit, self.history.record(search_resp, unit["route"])):
+                        for sink in self.sinks:
+                            sink.emit(event)
+
+                    if unit["date"] >= datetime.date.today().isoformat():
+                        heapq.heappush(schedule, (time.time() + self.poll_interval(unit), i))
+
+    def stop(self):
+        self._stop.set()
+        self.fly.stop_search()
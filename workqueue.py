@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+import concurrent.futures
+
+import batch
+import providers
+from providers.models import Flight
+
+
+class WorkQueue:
+    LEASE = 300
+    MAX_ATTEMPTS = 5
+
+    def __init__(self, path: str, lease: float = LEASE):
+        self.path = os.path.expanduser(path)
+        self.lease = lease
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS units ("
+                        "key TEXT PRIMARY KEY, provider TEXT, departure TEXT, destination TEXT, date TEXT, "
+                        "adults INTEGER, status TEXT, worker TEXT, lease_until REAL, attempts INTEGER, "
+                        "error TEXT, updated_at REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS units_status ON units (status, lease_until)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS results ("
+                        "key TEXT PRIMARY KEY, provider TEXT, departure TEXT, destination TEXT, date TEXT, "
+                        "adults INTEGER, worker TEXT, fetched_at REAL, result TEXT)")
+
+    @staticmethod
+    def key(provider: str, departure: str, destination: str, date: str, adults: int):
+        return "%s|%s|%s|%s|%d" % (provider, departure, destination, date, adults)
+
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can never claim the same unit
+        return _Transaction(self)
+
+    # Coordinator
+    def add_jobs(self, jobs: list):
+        units = [(unit, provider) for unit in batch.plan(jobs) for provider in sorted(unit["providers"])]
+        with self.transaction() as db:
+            before = db.total_changes
+            db.executemany("INSERT OR IGNORE INTO units VALUES (?, ?, ?, ?, ?, ?, 'pending', NULL, 0, 0, NULL, ?)", [
+                (self.key(provider, unit["departure"], unit["destination"], unit["date"], unit["adults"]),
+                 provider, unit["departure"], unit["destination"], unit["date"], unit["adults"], time.time())
+                for unit, provider in units
+            ])
+
+            return db.total_changes - before
+
+    def stats(self):
+        with self._lock:
+            return dict(self.db.execute("SELECT status, COUNT(*) FROM units GROUP BY status").fetchall())
+
+    def results(self):
+        with self._lock:
+            rows = self.db.execute("SELECT departure, destination, date, adults, result FROM results "
+                                   "ORDER BY departure, destination, date, adults, provider").fetchall()
+
+        for departure, destination, date, adults, result in rows:
+            yield {"departure": departure, "destination": destination, "date": date, "adults": adults,
+                   "result": [Flight.from_dict(x) for x in json.loads(result)]}
+
+    # Worker
+    def claim(self, worker: str, limit: int = 1):
+        now = time.time()
+        with self.transaction() as db:
+            # A worker lost on the last attempt: nobody else may take the unit, it failed
+            db.execute("UPDATE units SET status = 'failed', error = 'lease expired', updated_at = ? "
+                       "WHERE status = 'leased' AND lease_until < ? AND attempts >= ?", (now, now, self.MAX_ATTEMPTS))
+
+            # Pending units, or units whose worker missed its lease (crashed or stuck)
+            rows = db.execute("SELECT key, provider, departure, destination, date, adults FROM units "
+                              "WHERE (status = 'pending' OR (status = 'leased' AND lease_until < ?)) "
+                              "AND attempts < ? ORDER BY date, key LIMIT ?",
+                              (now, self.MAX_ATTEMPTS, limit)).fetchall()
+
+            db.executemany("UPDATE units SET status = 'leased', worker = ?, lease_until = ?, "
+                           "attempts = attempts + 1, updated_at = ? WHERE key = ?",
+                           [(worker, now + self.lease, now, row[0]) for row in rows])
+
+        return [dict(zip(("key", "provider", "departure", "destination", "date", "adults"), row)) for row in rows]
+
+    def complete(self, unit: dict, worker: str, search_resp: dict):
+        with self.transaction() as db:
+            # Same key, same row: a unit run twice (lease expired while still running) is merged, not duplicated
+            db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+                unit["key"], unit["provider"], unit["departure"], unit["destination"], unit["date"], unit["adults"],
+                worker, time.time(), json.dumps([x.to_dict() for x in search_resp["result"]])
+            ))
+            db.execute("UPDATE units SET status = 'done', worker = ?, error = NULL, updated_at = ? WHERE key = ?",
+                       (worker, time.time(), unit["key"]))
+
+    def fail(self, unit: dict, worker: str, error: str):
+        with self.transaction() as db:
+            db.execute("UPDATE units SET status = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END, "
+                       "error = ?, updated_at = ? WHERE key = ? AND status = 'leased' AND worker = ?",
+                       (self.MAX_ATTEMPTS, error, time.time(), unit["key"], worker))
+
+    def release(self, unit: dict, worker: str):
+        # Interrupted, not failed: the attempt is given back
+        with self.transaction() as db:
+            db.execute("UPDATE units SET status = 'pending', attempts = attempts - 1, updated_at = ? "
+                       "WHERE key = ? AND status = 'leased' AND worker = ?", (time.time(), unit["key"], worker))
+
+    def remaining(self):
+        with self._lock:
+            # Leased units count until they are done, or failed once their lease expired on the last attempt
+            return self.db.execute("SELECT COUNT(*) FROM units WHERE status = 'leased' "
+                                   "OR (status = 'pending' AND attempts < ?)", (self.MAX_ATTEMPTS,)).fetchone()[0]
+
+
+class _Transaction:
+    def __init__(self, queue: WorkQueue):
+        self.queue = queue
+
+    def __enter__(self):
+        self.queue._lock.acquire()
+        self.queue.db.execute("BEGIN IMMEDIATE")
+        return self.queue.db
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self.queue.db.execute("ROLLBACK" if exc_type else "COMMIT")
+
+        finally:
+            self.queue._lock.release()
+
+
+class Worker:
+    IDLE_SLEEP = 5
+
+    def __init__(self, queue: WorkQueue, workers: int = 1, cache=None, name: str = None):
+        self.queue = queue
+        self.workers = max(1, workers)
+        self.cache = cache
+        self.name = name or "%s:%d" % (socket.gethostname(), os.getpid())
+
+        self.running = False
+        self.providers = {}
+        self.locations = {}
+        self._lock = threading.Lock()
+
+    def provider(self, name: str):
+        with self._lock:
+            if name not in self.providers:
+                self.providers[name] = providers.PROVIDERS[name]()
+
+            return self.providers[name]
+
+    def location(self, provider, iata: str):
+        key = (provider.NAME, iata)
+        if key not in self.locations:
+            self.locations[key] = provider.prepare_location({"iata": iata})
+
+        return self.locations[key]
+
+    def execute(self, unit: dict):
+        provider = self.provider(unit["provider"])
+        departure = self.location(provider, unit["departure"])
+        destination = self.location(provider, unit["destination"])
+        if not departure or not destination:
+            raise providers.ProviderError("invalid IATA")
+
+        if self.cache:
+            return self.cache.search(provider, unit["adults"], unit["date"], departure, destination)
+
+        return provider.search(unit["adults"], unit["date"], departure, destination)
+
+    def run(self, forever: bool = False):
+        self.running = True
+        print("Worker: %s" % self.name)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers,
+                                                   thread_name_prefix="FlyQueueWorker") as executor:
+            while self.running:
+                units = self.queue.claim(self.name, self.workers)
+                if not units:
+                    # Other workers may still fail (or crash) and give units back
+                    if not forever and not self.queue.remaining():
+                        break
+
+                    time.sleep(self.IDLE_SLEEP)
+                    continue
+
+                futures = {executor.submit(self.execute, unit): unit for unit in units}
+                for future in concurrent.futures.as_completed(futures):
+                    unit = futures[future]
+                    try:
+                        self.queue.complete(unit, self.name, future.result())
+                        print("  • %s done" % unit["key"])
+
+                    except providers.SearchCancelled:
+                        self.queue.release(unit, self.name)
+
+                    except Exception as e:
+                        self.queue.fail(unit, self.name, str(e))
+                        print("[!] %s failed: %s" % (unit["key"], e))
+
+        self.running = False
+
+    def stop(self):
+        self.running = False
+
+        # Waiting and retrying requests stop now, their units go back to the queue
+        with self._lock:
+            for provider in self.providers.values():
+                provider.cancel()
@@ -0,0 +1,199 @@
+import os
+import csv
+import json
+import threading
+
+import providers
+
+
+def flatten(value):
+    if isinstance(value, (list, set, tuple)):
+        return "\n".join(str(x) for x in value)
+
+    if isinstance(value, dict):
+        return str(value)
+
+    return value
+
+
+class Writer:
+    EXTENSIONS = ()
+    # Flushed rows are readable on disk, even if the process is killed
+    INCREMENTAL = True
+
+    def __init__(self, path: str, sheet_name: str = None, columns: list = None, batch_size: int = 100):
+        self.path = os.path.expanduser(path)
+        self.sheet_name = sheet_name
+        self.columns = list(columns or providers.FLIGHT_DEFAULT)
+        self.batch_size = batch_size
+
+        self.buffer = []
+        self.closed = False
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.open()
+
+    def write(self, solution, **extra):
+        data = solution.to_dict()
+        data.update(extra)
+
+        with self._lock:
+            if self.closed:
+                return
+
+            self.buffer.append([data.get(k, "") for k in self.columns])
+            if len(self.buffer) >= self.batch_size:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self.buffer:
+            self.write_rows(self.buffer)
+            self.buffer = []
+
+    def close(self):
+        with self._lock:
+            if self.closed:
+                return
+
+            self._flush()
+            self.finish()
+            self.closed = True
+
+    # Format specific
+    def open(self):
+        pass
+
+    def write_rows(self, rows: list):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+
+class CsvWriter(Writer):
+    EXTENSIONS = (".csv", ".tsv")
+
+    def open(self):
+        delimiter = "\t" if self.path.endswith(".tsv") else ","
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+
+        # Rows are appended under the existing header: it must name the same columns
+        if not new_file:
+            with open(self.path, newline="", encoding="utf-8") as f:
+                header = next(csv.reader(f, delimiter=delimiter), [])
+
+            if header != self.columns:
+                raise ValueError("%s has other columns, save to a new file" % self.path)
+
+        self.file = open(self.path, "a", newline="", encoding="utf-8")
+        self.csv = csv.writer(self.file, delimiter=delimiter)
+        if new_file:
+            self.csv.writerow(self.columns)
+
+    def write_rows(self, rows: list):
+        self.csv.writerows([flatten(v) for v in row] for row in rows)
+        self.file.flush()
+
+    def finish(self):
+        self.file.close()
+
+
+class JsonLinesWriter(Writer):
+    EXTENSIONS = (".jsonl", ".ndjson")
+
+    def open(self):
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def write_rows(self, rows: list):
+        self.file.write("".join(json.dumps(dict(zip(self.columns, row)), default=str) + "\n" for row in rows))
+        self.file.flush()
+
+    def finish(self):
+        self.file.close()
+
+
+class XlsxWriter(Writer):
+    EXTENSIONS = (".xlsx",)
+    INCREMENTAL = False
+
+    def open(self):
+        import openpyxl
+
+        # Write-only workbooks stream rows to disk, previous sheets are copied over first
+        self.workbook = openpyxl.Workbook(write_only=True)
+        if os.path.exists(self.path):
+            previous = openpyxl.load_workbook(self.path, read_only=True)
+            for previous_sheet in previous.worksheets:
+                sheet = self.workbook.create_sheet(previous_sheet.title)
+                for row in previous_sheet.iter_rows(values_only=True):
+                    sheet.append(row)
+
+            previous.close()
+
+        self.sheet = self.workbook.create_sheet(self.sheet_name)
+        self.sheet.append(self.columns)
+
+    def write_rows(self, rows: list):
+        for row in rows:
+            self.sheet.append([flatten(v) for v in row])
+
+    def finish(self):
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        self.workbook.save(tmp_path)
+        os.replace(tmp_path, self.path)
+
+
+class ParquetWriter(Writer):
+    EXTENSIONS = (".parquet",)
+    INCREMENTAL = False
+
+    def open(self):
+        import pyarrow
+        import pyarrow.parquet
+
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([
+            (k, pyarrow.float64() if k == "price" else pyarrow.int64() if k == "stops" else pyarrow.string())
+            for k in self.columns
+        ])
+
+        # Parquet files cannot be appended to: the previous rows are copied to a new file that replaces it on close
+        previous = None
+        if os.path.exists(self.path):
+            previous = pyarrow.parquet.read_table(self.path)
+            if not previous.schema.equals(self.schema, check_metadata=False):
+                raise ValueError("%s has other columns, save to a new file" % self.path)
+
+        self.tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        self.writer = pyarrow.parquet.ParquetWriter(self.tmp_path, self.schema)
+        if previous is not None:
+            self.writer.write_table(previous)
+
+    def write_rows(self, rows: list):
+        columns = list(zip(*rows))
+        self.writer.write_table(self.pyarrow.Table.from_arrays([
+            self.pyarrow.array([v if field.type != self.pyarrow.string() else str(flatten(v)) for v in column],
+                               type=field.type)
+            for field, column in zip(self.schema, columns)
+        ], schema=self.schema))
+
+    def finish(self):
+        self.writer.close()
+        os.replace(self.tmp_path, self.path)
+
+
+WRITERS = {extension: writer for writer in (CsvWriter, JsonLinesWriter, XlsxWriter, ParquetWriter)
+           for extension in writer.EXTENSIONS}
+
+
+def open_writer(path: str, sheet_name: str = None, **kwargs):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in WRITERS:
+        raise ValueError("unsupported file type %s (choose from %s)" % (extension, ", ".join(WRITERS.keys())))
+
+    return WRITERS[extension](path, sheet_name, **kwargs)